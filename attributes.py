@@ -0,0 +1,105 @@
+import multiprocessing
+import queue
+import threading
+import time
+import numpy as np
+
+# Face attribute analysis (DeepFace age/gender) for live video. DeepFace runs in its own process, which loads
+# and warms up its models once at start; faces are queued without blocking the caller and every queued ROI is
+# sent in one batch per round trip. Results are cached per key (identity or track) for ATTRIBUTE_TTL seconds,
+# so each person is analysed about once a minute instead of on every frame.
+ATTRIBUTE_ACTIONS = ["age", "gender"]
+ATTRIBUTE_TTL = 60.0
+ATTRIBUTE_BATCH = 8
+ATTRIBUTE_CACHE_SIZE = 256
+
+def _analyze(DeepFace, roi):
+    try:
+        result = DeepFace.analyze(roi, ATTRIBUTE_ACTIONS, enforce_detection=False)
+        if result and "age" in result[0] and "gender" in result[0]:
+            return {"age": result[0]["age"], "gender": result[0]["gender"]}
+    except Exception as e:
+        print(f"Attribute analysis failed: {str(e)}")
+    return {}
+
+def _attribute_worker(requests, results):
+    try:
+        from deepface import DeepFace
+        # The first analyze() call builds the models; do it now instead of on the first real face
+        _analyze(DeepFace, np.zeros((112, 112, 3), np.uint8))
+    except Exception as e:
+        results.put(("error", str(e)))
+        return
+    results.put(("ready", None))
+    while True:
+        batch = [requests.get()]
+        while len(batch) < ATTRIBUTE_BATCH:
+            try:
+                batch.append(requests.get_nowait())
+            except queue.Empty:
+                break
+        stop = None in batch
+        batch = [item for item in batch if item is not None]
+        if batch:
+            results.put(("results", [(key, _analyze(DeepFace, roi)) for key, roi in batch]))
+        if stop:
+            break
+
+class AttributeAnalyzer:
+    def __init__(self, ttl=ATTRIBUTE_TTL):
+        self.ttl = ttl
+        self.ready = False
+        self.error = None
+        self._cache = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        # Spawned, not forked: the parent may already have loaded TensorFlow (single-image analysis) and runs
+        # pipeline, enroll and OSINT threads; a forked child inherits their locks and thread-pool state and can hang
+        ctx = multiprocessing.get_context("spawn")
+        self._requests = ctx.Queue()
+        self._results = ctx.Queue()
+        self._process = ctx.Process(target=_attribute_worker, args=(self._requests, self._results), daemon=True)
+        self._process.start()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def lookup(self, key, roi):
+        # Never blocks: cached attributes for key ({} until the first result arrives); a missing or expired
+        # entry queues the ROI for analysis and the stale value is returned meanwhile
+        now = time.monotonic()
+        with self._lock:
+            expires, attributes = self._cache.get(key, (0.0, {}))
+            if expires > now or self.error is not None or key in self._pending:
+                return attributes
+            self._pending.add(key)
+        # ROIs are usually views into a live frame, so only the face is copied and sent
+        self._requests.put((key, np.ascontiguousarray(roi).copy()))
+        return attributes
+
+    def _collect(self):
+        while True:
+            try:
+                kind, payload = self._results.get()
+            except (EOFError, OSError):
+                break
+            if kind == "ready":
+                self.ready = True
+            elif kind == "error":
+                print(f"Attribute analysis unavailable: {payload}")
+                with self._lock:
+                    self.error = payload
+                    self._pending.clear()
+                break
+            else:
+                expires = time.monotonic() + self.ttl
+                with self._lock:
+                    for key, attributes in payload:
+                        self._pending.discard(key)
+                        self._cache[key] = (expires, attributes)
+                    if len(self._cache) > ATTRIBUTE_CACHE_SIZE:
+                        now = time.monotonic()
+                        self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+
+    def close(self):
+        self._requests.put(None)
+        self._process.join(timeout=5)
@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import facerec
+from detectors import box_iou
+from pipeline import MotionGate
+from tracking import FaceTracker, DETECT_EVERY
+
+# Headless batch processing of recorded footage: one video per pool process, results written as a JSON lines
+# timeline with one entry per tracked face on every frame the detector ran on. Long videos can also be split
+# into frame ranges processed by separate workers; each range runs SEGMENT_OVERLAP frames past its end so that
+# tracks can be stitched across the boundary by IoU.
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".mov")
+SEGMENT_OVERLAP = 4 * DETECT_EVERY
+STITCH_MIN_IOU = 0.5
+
+_matcher = None
+_names = []
+
+def _init_batch_worker(model_file, meta_file):
+    global _matcher, _names
+    cv2.setNumThreads(1)
+    # Loads exactly what the parent trained, without re-fingerprinting the samples: a worker that retrained
+    # on its own would race the others writing the same cache files
+    facerec.MODEL_CACHE_FILE, facerec.MODEL_META_FILE = model_file, meta_file
+    cached = facerec.load_cached_model()
+    if cached is None:
+        raise RuntimeError(f"Model cache {model_file} is missing or unreadable")
+    model, _names = cached
+    _matcher = facerec.build_matcher(model, shards=1)
+
+def video_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, f) for f in sorted(os.listdir(path)) if f.lower().endswith(VIDEO_EXTENSIONS))
+        else:
+            files.append(path)
+    return files
+
+def timeline_entry(path, frame_number, fps, track):
+    return {
+        "file": path,
+        "frame": frame_number,
+        "timestamp": round(frame_number / fps, 3) if fps else None,
+        "track": track.track_id,
+        "box": list(track.box),
+        "identity": track.name,
+        "confidence": round(track.confidence, 2) if track.confidence != float("inf") else None,
+    }
+
+def video_segments(path, segments, overlap=SEGMENT_OVERLAP):
+    # [(start, end, stop)]: the segment owns frames start..end-1 and keeps tracking until stop for stitching
+    capture = cv2.VideoCapture(path)
+    total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) if capture.isOpened() else 0
+    capture.release()
+    if segments <= 1 or total <= 0:
+        return [(0, None, None)]
+    size = -(-total // segments)
+    bounds = []
+    for start in range(0, total, size):
+        end = min(start + size, total)
+        bounds.append((start, end, min(end + overlap, total)))
+    return bounds
+
+def process_video(path, detect_every=DETECT_EVERY, motion=True, start_frame=0, end_frame=None, stop_frame=None):
+    result = {"file": path, "start": start_frame, "end": end_frame, "entries": [], "frames": 0,
+              "started": time.time(), "finished": time.time()}
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        result["error"] = "failed to open video file"
+        return result
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    if start_frame:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    stop_frame = stop_frame if stop_frame is not None else end_frame
+    tracker = FaceTracker(detect_every=detect_every)
+    gate = MotionGate() if motion else None
+    entries = result["entries"]
+    frame_number = start_frame
+
+    def shared(n):
+        # Frames this segment shares with a neighbour: the tail past end_frame and the head the previous segment
+        # tracks into. They are never gated and are detected on a fixed frame grid, so both workers detect on
+        # the same frames and merge_segments() has boxes to stitch a static person's tracks with.
+        return (end_frame is not None and n >= end_frame) or (start_frame > 0 and n < start_frame + SEGMENT_OVERLAP)
+
+    try:
+        while stop_frame is None or frame_number < stop_frame:
+            ret, frame = capture.read()
+            if not ret or frame is None or frame.size == 0:
+                break
+            overlap = shared(frame_number)
+            moving = gate is None or gate.check(frame)
+            if moving or overlap:
+                detect = frame_number % detect_every == 0 if overlap else tracker.detects_frame(frame_number)
+                context, detections = facerec.analyse_frame(frame, detect)
+                tracker.update(detections)
+                facerec.recognize_tracks(_matcher, frame, context, tracker, _names)
+                if detect:
+                    entries.extend(timeline_entry(path, frame_number, fps, track) for track in tracker.active())
+            frame_number += 1
+            for _ in range(gate.stride - 1 if gate else 0):
+                if (stop_frame is not None and frame_number >= stop_frame) or shared(frame_number) \
+                        or not capture.grab():
+                    break
+                gate.skipped()
+                frame_number += 1
+    finally:
+        capture.release()
+    result["frames"] = (min(frame_number, end_frame) if end_frame is not None else frame_number) - start_frame
+    result["finished"] = time.time()
+    return result
+
+def _boundary_matches(tail, head, min_iou):
+    # Maps the later segment's track ids onto the earlier segment's, by IoU on the frames both of them tracked
+    before, after = defaultdict(list), defaultdict(list)
+    for entry in tail:
+        before[entry["frame"]].append(entry)
+    for entry in head:
+        after[entry["frame"]].append(entry)
+    pairs = [(frame, frame) for frame in sorted(set(before) & set(after))]
+    if not pairs and before and after:
+        pairs = [(max(before), min(after))]
+    votes = Counter()
+    for frame_before, frame_after in pairs:
+        for entry in after[frame_after]:
+            best = max(before[frame_before], key=lambda e: box_iou(e["box"], entry["box"]))
+            if box_iou(best["box"], entry["box"]) >= min_iou:
+                votes[(entry["track"], best["track"])] += 1
+    mapping = {}
+    for (local, stitched), _ in votes.most_common():
+        if local not in mapping and stitched not in mapping.values():
+            mapping[local] = stitched
+    return mapping
+
+def merge_segments(results, min_iou=STITCH_MIN_IOU):
+    # Ordered timeline of one file with track ids made unique across segments and stitched at the boundaries
+    timeline = []
+    tail = []
+    next_id = 1
+    for result in sorted(results, key=lambda r: r["start"]):
+        entries = result["entries"]
+        last_tail_frame = max((e["frame"] for e in tail), default=-1)
+        mapping = _boundary_matches(tail, [e for e in entries if e["frame"] <= last_tail_frame], min_iou) if tail else {}
+        for local in sorted({e["track"] for e in entries}):
+            if local not in mapping:
+                mapping[local] = next_id
+                next_id += 1
+        tail = []
+        for entry in entries:
+            entry = dict(entry, track=mapping[entry["track"]])
+            if result["end"] is None or entry["frame"] < result["end"]:
+                timeline.append(entry)
+            else:
+                tail.append(entry)
+    return timeline
+
+def main():
+    parser = argparse.ArgumentParser(description="Identify known faces in recorded videos without the GUI")
+    parser.add_argument("videos", nargs="+", help="video files or directories of videos")
+    parser.add_argument("--output", default="timeline.jsonl", help="JSON lines timeline to write")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="videos processed at once")
+    parser.add_argument("--detect-every", type=int, default=DETECT_EVERY, help="run full detection every N frames")
+    parser.add_argument("--no-motion-gate", action="store_true", help="analyse static frames too")
+    parser.add_argument("--segments", type=int, default=1, help="split each video into N frame ranges processed in parallel")
+    args = parser.parse_args()
+
+    files = video_files(args.videos)
+    if not files:
+        print("No video files found.")
+        return
+    model, names = facerec.train_model()
+    if model is None:
+        print("No trained model available.")
+        return
+    if facerec.load_cached_model() is None:
+        print(f"Model cache {facerec.MODEL_CACHE_FILE} could not be written; workers need it to load the model.")
+        return
+    tasks = [(path, bounds) for path in files for bounds in video_segments(path, args.segments)]
+    pending = Counter(path for path, _ in tasks)
+    segments = defaultdict(list)
+    total_frames = 0
+    start = time.perf_counter()
+    with open(args.output, "w", encoding="utf-8") as out, \
+            ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(tasks))), initializer=_init_batch_worker,
+                                initargs=(facerec.MODEL_CACHE_FILE, facerec.MODEL_META_FILE)) as pool:
+        futures = [pool.submit(process_video, path, args.detect_every, not args.no_motion_gate, *bounds) for path, bounds in tasks]
+        for future in as_completed(futures):
+            result = future.result()
+            path = result["file"]
+            segments[path].append(result)
+            pending[path] -= 1
+            if pending[path]:
+                continue
+            results = segments.pop(path)
+            errors = [r["error"] for r in results if r.get("error")]
+            if errors:
+                print(f"{path}: {errors[0]}")
+                continue
+            timeline = merge_segments(results)
+            for entry in timeline:
+                out.write(json.dumps(entry) + "\n")
+            frames = sum(r["frames"] for r in results)
+            seconds = max(r["finished"] for r in results) - min(r["started"] for r in results)
+            total_frames += frames
+            identities = sorted({e["identity"] for e in timeline if e["identity"]})
+            print(f"{path}: {frames} frames in {len(results)} segment(s), {frames / max(seconds, 1e-9):.1f} fps, "
+                  f"{len(timeline)} detections, {len({e['track'] for e in timeline})} tracks, "
+                  f"identities: {', '.join(identities) or 'none'}")
+    elapsed = time.perf_counter() - start
+    print(f"{len(files)} files, {total_frames} frames in {elapsed:.1f}s: {total_frames / elapsed:.1f} fps aggregate")
+    print(f"Timeline written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+import argparse
+import gc
+import json
+import os
+import time
+import tracemalloc
+import cv2
+import numpy as np
+import facerec
+import detectors
+import tracking
+import pipeline
+
+def load_query_faces(images_dir):
+    faces = []
+    for file_name in sorted(os.listdir(images_dir)):
+        img = cv2.imread(os.path.join(images_dir, file_name))
+        if img is None:
+            continue
+        face_coords, gray, _ = facerec.detect_faces(img)
+        if len(face_coords) == 0:
+            continue
+        (x, y, w, h) = max(face_coords, key=lambda f: f[2] * f[3])
+        faces.append(gray[y:y + h, x:x + w])
+    return faces
+
+def bench_recall(args):
+    model, names = facerec.train_model()
+    if model is None:
+        print("No trained model available.")
+        return
+    faces = load_query_faces(args.images)
+    if not faces:
+        print(f"No faces found in {args.images}")
+        return
+    gallery = facerec.TwoStageGallery.from_gallery(model, projection=args.projection)
+    queries = gallery.histograms_for(faces)
+    print(f"Gallery: {len(gallery)} samples, {len(gallery.subject_labels)} subjects, {len(faces)} query faces")
+
+    start = time.perf_counter()
+    facerec.LBPHGallery.match_histograms(gallery, queries, args.k)
+    exhaustive_ms = (time.perf_counter() - start) * 1000 / len(faces)
+    print(f"exhaustive: {exhaustive_ms:.2f} ms/face")
+
+    recall = facerec.shortlist_recall(gallery, queries, args.sizes, args.k)
+    for size in args.sizes:
+        start = time.perf_counter()
+        gallery.match_histograms(queries, args.k, shortlist=size)
+        staged_ms = (time.perf_counter() - start) * 1000 / len(faces)
+        print(f"shortlist {size:>5}: {staged_ms:.2f} ms/face, recall@{args.k} {recall[size]:.3f}, "
+              f"speedup {exhaustive_ms / staged_ms:.1f}x")
+
+def iter_clip_frames(clip_path, max_frames):
+    capture = cv2.VideoCapture(clip_path)
+    try:
+        for _ in range(max_frames):
+            ret, frame = capture.read()
+            if not ret:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+def clip_paths(clips):
+    paths = []
+    for clip in clips:
+        if os.path.isdir(clip):
+            paths.extend(os.path.join(clip, f) for f in sorted(os.listdir(clip))
+                         if f.lower().endswith((".mp4", ".mkv", ".avi", ".mov")))
+        else:
+            paths.append(clip)
+    return paths
+
+def bench_detect(args):
+    # Baseline is the full-resolution cascade without size limits, i.e. the old detect_faces()
+    settings = [("baseline", 1.0, None, None)]
+    settings += [(f"scale {scale}", scale, args.min_size, args.max_size) for scale in args.scales]
+    for clip in clip_paths(args.clips):
+        frames = [cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in iter_clip_frames(clip, args.frames)]
+        if not frames:
+            print(f"{clip}: no frames decoded")
+            continue
+        print(f"{clip}: {len(frames)} frames at {frames[0].shape[1]}x{frames[0].shape[0]}")
+        baseline_fps = None
+        for label, scale, min_size, max_size in settings:
+            faces = 0
+            start = time.perf_counter()
+            for gray in frames:
+                faces += len(facerec.detect_face_boxes(gray, scale, min_size, max_size))
+            fps = len(frames) / (time.perf_counter() - start)
+            baseline_fps = baseline_fps or fps
+            print(f"  {label:<12} {fps:8.1f} fps  {fps / baseline_fps:5.2f}x  {faces} faces")
+
+def load_truth(path):
+    # JSON lines of {"clip": <file name>, "frame": <index>, "boxes": [[x, y, w, h], ...]}
+    truth = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                truth[(os.path.basename(entry["clip"]), entry["frame"])] = entry["boxes"]
+    return truth
+
+def run_detector(detector, frames, batch, min_size):
+    boxes = []
+    start = time.perf_counter()
+    for i in range(0, len(frames), batch):
+        boxes.extend(detector.detect_batch(frames[i:i + batch], min_size=min_size))
+    return boxes, len(frames) / (time.perf_counter() - start)
+
+def bench_detectors(args):
+    backends = [("haar", detectors.HaarDetector(), 1)]
+    backends.append(("dnn", detectors.DnnFaceDetector(args.model, args.config, args.confidence), args.batch))
+    truth = load_truth(args.truth) if args.truth else None
+    for clip in clip_paths(args.clips):
+        frames = list(iter_clip_frames(clip, args.frames))
+        if not frames:
+            print(f"{clip}: no frames decoded")
+            continue
+        print(f"{clip}: {len(frames)} frames at {frames[0].shape[1]}x{frames[0].shape[0]}")
+        results = {}
+        for name, detector, batch in backends:
+            results[name], fps = run_detector(detector, frames, batch, args.min_size)
+            found = sum(len(b) for b in results[name])
+            line = f"  {name:<5} {fps:8.1f} fps  {found} faces"
+            if truth is not None:
+                keys = [(os.path.basename(clip), i) for i in range(len(frames))]
+                hits = sum(detectors.match_boxes(b, truth.get(key, [])) for b, key in zip(results[name], keys))
+                expected = sum(len(truth.get(key, [])) for key in keys)
+                line += f"  precision {hits / max(found, 1):.3f}  recall {hits / max(expected, 1):.3f}"
+            print(line)
+        if truth is None:
+            # No ground truth: report how often each backend's boxes are confirmed by the other
+            agreed = sum(detectors.match_boxes(d, h) for d, h in zip(results["dnn"], results["haar"]))
+            haar_found = sum(len(b) for b in results["haar"])
+            dnn_found = sum(len(b) for b in results["dnn"])
+            print(f"  agreement: {agreed / max(haar_found, 1):.3f} of haar boxes, {agreed / max(dnn_found, 1):.3f} of dnn boxes")
+
+def bench_track(args):
+    # Per-frame detect_faces() + recognize_face() (old video loops) vs track-by-detection
+    model, names = facerec.train_model()
+    if model is None:
+        print("No trained model available.")
+        return
+    matcher = facerec.build_matcher(model)
+    for clip in clip_paths(args.clips):
+        frames = list(iter_clip_frames(clip, args.frames))
+        if not frames:
+            print(f"{clip}: no frames decoded")
+            continue
+        print(f"{clip}: {len(frames)} frames at {frames[0].shape[1]}x{frames[0].shape[0]}")
+        start = time.perf_counter()
+        for frame in frames:
+            face_coords, gray, _ = facerec.detect_faces(frame)
+            facerec.recognize_face(matcher, frame.copy(), gray, face_coords, names)
+        full_fps = len(frames) / (time.perf_counter() - start)
+        tracker = tracking.FaceTracker(detect_every=args.detect_every)
+        start = time.perf_counter()
+        for frame in frames:
+            _, context = facerec.track_faces(tracker, frame)
+            facerec.recognize_tracks(matcher, frame.copy(), context, tracker, names)
+        tracked_fps = len(frames) / (time.perf_counter() - start)
+        stats = tracker.stats
+        print(f"  per frame {full_fps:8.1f} fps")
+        print(f"  tracked   {tracked_fps:8.1f} fps  {tracked_fps / full_fps:5.2f}x  "
+              f"{stats['detections']} detections, {stats['identifications']} identifications, "
+              f"{stats['tracks_created']} tracks")
+
+def bench_pipeline(args):
+    # Sequential decode -> detect -> recognize (old videofile loop) vs the threaded pipeline, both unpaced
+    model, names = facerec.train_model()
+    if model is None:
+        print("No trained model available.")
+        return
+    matcher = facerec.build_matcher(model)
+    size = tuple(args.size)
+    for clip in clip_paths(args.clips):
+        tracker = tracking.FaceTracker()
+        capture = cv2.VideoCapture(clip)
+        frames = 0
+        start = time.perf_counter()
+        while frames < args.frames:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            frame = cv2.resize(cv2.flip(frame, 1, 0), size, interpolation=cv2.INTER_AREA)
+            _, context = facerec.track_faces(tracker, frame)
+            facerec.recognize_tracks(matcher, frame, context, tracker, names)
+            frames += 1
+        capture.release()
+        if not frames:
+            print(f"{clip}: no frames decoded")
+            continue
+        sequential = time.perf_counter() - start
+        print(f"{clip}: {frames} frames")
+        print(f"  sequential  {frames / sequential:8.1f} fps")
+
+        tracker = tracking.FaceTracker()
+        capture = cv2.VideoCapture(clip)
+        def combine(index, frame, analysis):
+            tracker.update(analysis[1])
+            return facerec.recognize_tracks(matcher, frame, analysis[0], tracker, names)
+        stages = pipeline.VideoPipeline(capture,
+                                        lambda frame: cv2.resize(cv2.flip(frame, 1, 0), size, interpolation=cv2.INTER_AREA),
+                                        lambda index, frame: facerec.analyse_frame(frame, tracker.detects_frame(index)),
+                                        combine, workers=args.workers, realtime=False)
+        start = time.perf_counter()
+        stages.start()
+        while not stages.finished() and stages.stats["decoded"] < frames:
+            time.sleep(0.001)
+        stages.stop()
+        stages.join()
+        elapsed = time.perf_counter() - start
+        stats = stages.stats
+        print(f"  pipeline    {stats['decoded'] / elapsed:8.1f} fps decoded, {stats['combined'] / elapsed:.1f} fps processed "
+              f"({stages.frames.dropped + stages.analysed.dropped} dropped, {stats['late']} late)")
+
+def bench_motion(args):
+    # Detection on every decoded frame vs the motion gate with grab() for frames inside the stride
+    for clip in clip_paths(args.clips):
+        capture = cv2.VideoCapture(clip)
+        frames = 0
+        start = time.perf_counter()
+        while frames < args.frames:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            facerec.analyse_frame(frame)
+            frames += 1
+        capture.release()
+        if not frames:
+            print(f"{clip}: no frames decoded")
+            continue
+        full = time.perf_counter() - start
+
+        gate = pipeline.MotionGate(max_stride=args.max_stride)
+        capture = cv2.VideoCapture(clip)
+        start = time.perf_counter()
+        while gate.stats["frames"] < frames:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            if gate.check(frame):
+                facerec.analyse_frame(frame)
+            for _ in range(min(gate.stride - 1, frames - gate.stats["frames"])):
+                if not capture.grab():
+                    break
+                gate.skipped()
+        capture.release()
+        gated = time.perf_counter() - start
+        print(f"{clip}: {gate.summary()}")
+        print(f"  every frame {frames / full:8.1f} fps")
+        print(f"  gated       {gate.stats['frames'] / gated:8.1f} fps  {full / gated:5.2f}x")
+
+def legacy_show(frame, size):
+    # showImage() before DisplaySink: resize, convert, new PIL image and new PhotoImage on every frame
+    from PIL import Image, ImageTk
+    img = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return ImageTk.PhotoImage(Image.fromarray(img))
+
+def measure_display(show, frames, size):
+    # Transient bytes per frame: how far traced memory rises above its level at the start of each frame
+    show(frames[0], size)
+    collections = []
+    def on_gc(phase, info):
+        if phase == "start":
+            collections.append(info["generation"])
+    gc.callbacks.append(on_gc)
+    tracemalloc.start()
+    churn = 0
+    start = time.perf_counter()
+    for frame in frames:
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        show(frame, size)
+        churn += tracemalloc.get_traced_memory()[1] - current
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+    gc.callbacks.remove(on_gc)
+    return len(frames) / elapsed, churn / len(frames), len(collections)
+
+def bench_display(args):
+    import tkinter as tk
+    from display import DisplaySink
+    root = tk.Tk()
+    root.withdraw()
+    size = tuple(args.size)
+    rng = np.random.default_rng(0)
+    # Frames arrive already at display size from the video loops; --source-size exercises the resize path
+    source = tuple(args.source_size or args.size)
+    frames = [rng.integers(0, 256, (source[1], source[0], 3), np.uint8) for _ in range(8)] * (args.frames // 8)
+    sink = DisplaySink()
+    for label, show in [("legacy", legacy_show), ("sink", sink.show)]:
+        gc.collect()
+        fps, churn, collections = measure_display(show, frames, size)
+        print(f"{label:<7} {fps:8.1f} fps  {churn / 1024:8.1f} KiB allocated/frame  {collections} gc runs over {len(frames)} frames")
+    root.destroy()
+
+def bench_cascade(args):
+    # Old register.detect_faces() built a new CascadeClassifier (parsing the XML) on every call
+    gray = np.zeros((args.height, args.width), np.uint8)
+    path = detectors.cascade_path(detectors.FRONTAL_FACE_CASCADE)
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        cv2.CascadeClassifier(path).detectMultiScale(gray, 1.1, 5, minSize=(30, 30))
+    per_call_ms = (time.perf_counter() - start) * 1000 / args.calls
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        detectors.get_cascade().detectMultiScale(gray, 1.1, 5, minSize=(30, 30))
+    registry_ms = (time.perf_counter() - start) * 1000 / args.calls
+    print(f"load per call: {per_call_ms:.2f} ms/call")
+    print(f"registry:      {registry_ms:.2f} ms/call ({per_call_ms - registry_ms:.2f} ms load cost removed)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance benchmarks for the recognition pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    recall = sub.add_parser("recall", help="two-stage gallery search: recall and speed vs exhaustive search")
+    recall.add_argument("--images", required=True, help="directory of query images")
+    recall.add_argument("--sizes", type=int, nargs="+", default=[10, 25, 50, 100])
+    recall.add_argument("--k", type=int, default=1)
+    recall.add_argument("--projection", choices=["pool", "pca"], default="pool")
+    recall.set_defaults(func=bench_recall)
+
+    detect = sub.add_parser("detect", help="downscaled face detection: fps vs full-resolution detection")
+    detect.add_argument("clips", nargs="+", help="video files or directories of clips")
+    detect.add_argument("--frames", type=int, default=300, help="frames per clip")
+    detect.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.5, 0.33])
+    detect.add_argument("--min-size", type=int, default=40, help="smallest face in full-resolution pixels")
+    detect.add_argument("--max-size", type=int, default=None, help="largest face in full-resolution pixels")
+    detect.set_defaults(func=bench_detect)
+
+    backends = sub.add_parser("detectors", help="DNN (ResNet-10 SSD) vs Haar face detection: fps and precision")
+    backends.add_argument("clips", nargs="+", help="video files or directories of clips")
+    backends.add_argument("--model", default=facerec.FACE_DNN_MODEL, help=".caffemodel or .onnx file")
+    backends.add_argument("--config", default=facerec.FACE_DNN_CONFIG, help="deploy.prototxt for Caffe models")
+    backends.add_argument("--confidence", type=float, default=0.5)
+    backends.add_argument("--batch", type=int, default=8, help="frames per DNN forward pass")
+    backends.add_argument("--frames", type=int, default=300, help="frames per clip")
+    backends.add_argument("--min-size", type=int, default=40, help="smallest face in full-resolution pixels")
+    backends.add_argument("--truth", help="JSON lines of annotated boxes; without it only agreement is reported")
+    backends.set_defaults(func=bench_detectors)
+
+    track = sub.add_parser("track", help="track-by-detection vs detecting and recognizing every frame")
+    track.add_argument("clips", nargs="+", help="video files or directories of clips")
+    track.add_argument("--frames", type=int, default=300, help="frames per clip")
+    track.add_argument("--detect-every", type=int, default=tracking.DETECT_EVERY)
+    track.set_defaults(func=bench_track)
+
+    threaded = sub.add_parser("pipeline", help="threaded decode/analysis/combine pipeline vs the sequential loop")
+    threaded.add_argument("clips", nargs="+", help="video files or directories of clips")
+    threaded.add_argument("--frames", type=int, default=300, help="frames per clip")
+    threaded.add_argument("--workers", type=int, default=pipeline.ANALYSIS_WORKERS)
+    threaded.add_argument("--size", type=int, nargs=2, default=[600, 500], help="display size frames are resized to")
+    threaded.set_defaults(func=bench_pipeline)
+
+    motion = sub.add_parser("motion", help="motion-gated frame stride vs detecting on every frame")
+    motion.add_argument("clips", nargs="+", help="video files or directories of clips")
+    motion.add_argument("--frames", type=int, default=1000, help="frames per clip")
+    motion.add_argument("--max-stride", type=int, default=pipeline.MOTION_MAX_STRIDE)
+    motion.set_defaults(func=bench_motion)
+
+    display = sub.add_parser("display", help="showImage() display path: DisplaySink vs a new PhotoImage per frame")
+    display.add_argument("--frames", type=int, default=400)
+    display.add_argument("--size", type=int, nargs=2, default=[600, 500], help="panel size")
+    display.add_argument("--source-size", type=int, nargs=2, default=None, help="frame size if it differs from the panel")
+    display.set_defaults(func=bench_display)
+
+    cascade = sub.add_parser("cascade", help="cascade registry vs constructing a cascade per detection call")
+    cascade.add_argument("--calls", type=int, default=50)
+    cascade.add_argument("--width", type=int, default=460)
+    cascade.add_argument("--height", type=int, default=460)
+    cascade.set_defaults(func=bench_cascade)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import os
+import threading
+import cv2
+import numpy as np
+from frames import FrameContext
+
+# Shared registry of OpenCV detectors. A CascadeClassifier must not be used from several threads at once,
+# so every thread gets its own instance, loaded the first time that thread asks for it and reused afterwards.
+FRONTAL_FACE_CASCADE = "haarcascade_frontalface_default.xml"
+EYE_CASCADE = "haarcascade_eye.xml"
+
+_local = threading.local()
+
+def cascade_path(name):
+    return name if os.path.isabs(name) else os.path.join(cv2.data.haarcascades, name)
+
+def get_cascade(name=FRONTAL_FACE_CASCADE):
+    cascades = getattr(_local, "cascades", None)
+    if cascades is None:
+        cascades = _local.cascades = {}
+    cascade = cascades.get(name)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(cascade_path(name))
+        if cascade.empty():
+            raise FileNotFoundError(f"Haar cascade {name} not found or corrupted.")
+        cascades[name] = cascade
+    return cascade
+
+def _as_size(size):
+    return (size, size) if isinstance(size, (int, float)) else tuple(size)
+
+def box_iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    inter_w = min(ax + aw, bx + bw) - max(ax, bx)
+    inter_h = min(ay + ah, by + bh) - max(ay, by)
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    return inter / float(aw * ah + bw * bh - inter)
+
+def match_boxes(predicted, truth, min_iou=0.5):
+    # Greedy one-to-one matching by IoU; returns the number of predicted boxes that hit a true box
+    unmatched = list(truth)
+    hits = 0
+    for box in predicted:
+        scores = [box_iou(box, t) for t in unmatched]
+        if scores and max(scores) >= min_iou:
+            unmatched.pop(int(np.argmax(scores)))
+            hits += 1
+    return hits
+
+class HaarDetector:
+    # Haar cascade backend. Runs on a copy downscaled by `scale` and maps boxes back to full resolution;
+    # min_size/max_size are in full-resolution pixels.
+    def __init__(self, cascade=FRONTAL_FACE_CASCADE, scale_factor=1.1, min_neighbors=4):
+        self.cascade = cascade
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        get_cascade(cascade)
+
+    def detect(self, image, scale=1.0, min_size=None, max_size=None):
+        # image may be a frame or a FrameContext; either way the gray and downscaled views come from the context
+        context = FrameContext.of(image)
+        scale = min(scale, 1.0)
+        gray, small = context.gray, context.downscaled(scale)
+        kwargs = {}
+        # Scales below min_size can never hold a usable face, so the cascade skips them entirely
+        if min_size:
+            kwargs["minSize"] = tuple(max(1, int(v * scale)) for v in _as_size(min_size))
+        if max_size:
+            kwargs["maxSize"] = tuple(max(1, int(round(v * scale))) for v in _as_size(max_size))
+        faces = get_cascade(self.cascade).detectMultiScale(small, self.scale_factor, self.min_neighbors, **kwargs)
+        if scale == 1.0 or len(faces) == 0:
+            return faces
+        boxes = np.round(np.asarray(faces, np.float64) / scale).astype(np.int32)
+        height, width = gray.shape[:2]
+        boxes[:, 2] = np.minimum(boxes[:, 2], width - boxes[:, 0])
+        boxes[:, 3] = np.minimum(boxes[:, 3], height - boxes[:, 1])
+        return boxes
+
+    def detect_batch(self, images, scale=1.0, min_size=None, max_size=None):
+        return [self.detect(image, scale, min_size, max_size) for image in images]
+
+class DnnFaceDetector:
+    # cv2.dnn backend for the ResNet-10 SSD face detector, loaded from local files: either a Caffe
+    # deploy.prototxt + res10_300x300_ssd_iter_140000.caffemodel pair or an ONNX export. Runs on the CPU;
+    # detect_batch() pushes several frames through the network as one blob. Each thread gets its own Net.
+    def __init__(self, model_path, config_path=None, confidence=0.5, input_size=(300, 300), mean=(104.0, 177.0, 123.0)):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"DNN face model not found: {model_path}")
+        if not model_path.lower().endswith(".onnx") and (config_path is None or not os.path.exists(config_path)):
+            raise FileNotFoundError(f"DNN face model config not found: {config_path}")
+        self.model_path = model_path
+        self.config_path = config_path
+        self.confidence = confidence
+        self.input_size = input_size
+        self.mean = mean
+        self._local = threading.local()
+        self._net()
+
+    def _net(self):
+        net = getattr(self._local, "net", None)
+        if net is None:
+            if self.model_path.lower().endswith(".onnx"):
+                net = cv2.dnn.readNetFromONNX(self.model_path)
+            else:
+                net = cv2.dnn.readNetFromCaffe(self.config_path, self.model_path)
+            net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            self._local.net = net
+        return net
+
+    def detect(self, image, scale=1.0, min_size=None, max_size=None):
+        return self.detect_batch([image], scale, min_size, max_size)[0]
+
+    def detect_batch(self, images, scale=1.0, min_size=None, max_size=None):
+        # scale is accepted for interface compatibility; the network always sees input_size
+        if len(images) == 0:
+            return []
+        images = [image.frame if isinstance(image, FrameContext) else image for image in images]
+        images = [image if image.ndim == 3 else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) for image in images]
+        blob = cv2.dnn.blobFromImages(images, 1.0, self.input_size, self.mean, swapRB=False, crop=False)
+        net = self._net()
+        net.setInput(blob)
+        detections = net.forward().reshape(-1, 7)
+        min_w, min_h = _as_size(min_size) if min_size else (0, 0)
+        max_w, max_h = _as_size(max_size) if max_size else (float("inf"), float("inf"))
+        results = [[] for _ in images]
+        for image_id, _, confidence, x1, y1, x2, y2 in detections:
+            index = int(image_id)
+            if confidence < self.confidence or not 0 <= index < len(images):
+                continue
+            height, width = images[index].shape[:2]
+            left, top = int(max(0.0, x1) * width), int(max(0.0, y1) * height)
+            right, bottom = int(min(1.0, x2) * width), int(min(1.0, y2) * height)
+            w, h = right - left, bottom - top
+            if min_w <= w <= max_w and min_h <= h <= max_h and w > 0 and h > 0:
+                results[index].append((left, top, w, h))
+        return [np.array(boxes, np.int32) if boxes else () for boxes in results]
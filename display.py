@@ -0,0 +1,32 @@
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+# Display path for video panels. One PhotoImage is kept per panel and frames are pasted into it; resizing and
+# colour conversion write into preallocated buffers, and the PIL image shares the RGBA buffer's memory, so a
+# steady stream of same-sized frames allocates nothing per frame on the Python side.
+class DisplaySink:
+    def __init__(self):
+        self.photo = None
+        self._resized = None
+        self._rgba = None
+        self._image = None
+
+    def show(self, frame, size):
+        # Returns the panel's PhotoImage; it only changes identity when the display size changes
+        width, height = size
+        if frame.shape[1] != width or frame.shape[0] != height:
+            if self._resized is None or self._resized.shape != (height, width, 3):
+                self._resized = np.empty((height, width, 3), np.uint8)
+            cv2.resize(frame, size, dst=self._resized, interpolation=cv2.INTER_AREA)
+            frame = self._resized
+        if self._rgba is None or self._rgba.shape[:2] != (height, width):
+            self._rgba = np.empty((height, width, 4), np.uint8)
+            self._image = Image.frombuffer("RGBA", size, self._rgba, "raw", "RGBA", 0, 1)
+            self.photo = None
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA, dst=self._rgba)
+        if self.photo is None:
+            self.photo = ImageTk.PhotoImage(self._image)
+        else:
+            self.photo.paste(self._image)
+        return self.photo
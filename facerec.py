@@ -2,11 +2,24 @@
 
 import cv2
 import os
+import json
+import hashlib
+import sys
+import threading
+import weakref
+import collections
+import copy
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
 import requests
 from bs4 import BeautifulSoup
 import exifread
 import logging
+from frames import FrameContext
+from detectors import get_cascade, HaarDetector, DnnFaceDetector, FRONTAL_FACE_CASCADE, EYE_CASCADE
 
 # API credentials
 SERPAPI_KEY = os.getenv('SERPAPI_KEY', 'Your-Api-Key')
@@ -19,12 +32,60 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 project_dir = os.path.dirname(os.path.abspath(__file__))
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+face_samples_dir = os.path.join(project_dir, "face_samples")
 
-if face_cascade.empty() or eye_cascade.empty():
+# Trained gallery cache (LBP histograms and labels as raw arrays), keyed by a fingerprint of face_samples/
+model_cache_dir = os.path.join(project_dir, "model_cache")
+MODEL_CACHE_FILE = os.path.join(model_cache_dir, "lbph_gallery.npz")
+MODEL_META_FILE = os.path.join(model_cache_dir, "lbph_gallery.json")
+TEMP_SAMPLES_DIR = "temp_criminal"
+# Written by register.registerCriminal next to the crops it saves; lists samples that are already face crops
+CROP_MANIFEST = "crops.json"
+# Below this many sample images a process pool costs more than it saves
+PARALLEL_MIN_SAMPLES = 64
+# Images handed to the pool per worker at a time while streaming samples into training
+SAMPLE_BATCH_PER_WORKER = 64
+# Memory ceiling for decoded face crops held at once; the model is trained/updated one chunk at a time
+TRAIN_CHUNK_MB = 256
+# LBPH distance below which a face counts as a match
+RECOGNITION_THRESHOLD = 100
+# Tracked faces whose last match was within this distance of the threshold get identified again
+UNCERTAIN_MARGIN = 15
+# Upper bound on float32 elements materialized at once when comparing faces against the gallery
+GALLERY_CHUNK_ELEMENTS = 8 * 1024 * 1024
+# Watchlists with more subjects than this are searched coarse-to-fine, keeping SHORTLIST_SIZE subjects per face
+TWO_STAGE_MIN_SUBJECTS = 500
+SHORTLIST_SIZE = 50
+# Gallery rows sampled to fit the PCA projection of the coarse stage
+PCA_FIT_SAMPLES = 2000
+# Galleries with at least this many samples are split by subject across worker processes
+SHARDED_MIN_SAMPLES = 20000
+# Faces per scatter/gather round trip; larger frames are matched in several rounds
+SHARD_MAX_QUERY_FACES = 32
+# Seconds a background retrain may run before it is killed and reported as failed
+RETRAIN_TIMEOUT = 1800
+# Face detection: the cascade runs on a copy downscaled by DETECT_SCALE and boxes are mapped back to full
+# resolution; sizes are in full-resolution pixels, None means no limit (scale 1.0 / None is the old behaviour)
+DETECT_SCALE = 1.0
+DETECT_MIN_SIZE = None
+DETECT_MAX_SIZE = None
+# Face detector backend: "haar" (default) or "dnn", the ResNet-10 SSD read from local model files
+FACE_DETECTOR = os.getenv("FACE_DETECTOR", "haar")
+FACE_DNN_MODEL = os.getenv("FACE_DNN_MODEL", os.path.join(project_dir, "models", "res10_300x300_ssd_iter_140000.caffemodel"))
+FACE_DNN_CONFIG = os.getenv("FACE_DNN_CONFIG", os.path.join(project_dir, "models", "deploy.prototxt"))
+_face_detector = None
+# Fraction of the face box, from the top, that find_eyes() searches. Haar face boxes put the eye centres at
+# roughly 40-50% of the height, so the upper half alone clips the lower half of the eye boxes
+EYE_REGION = 0.6
+_model_lock = threading.RLock()
+
+# Cascades come from the per-thread registry in detectors.py; load them once here to fail early if missing
+try:
+    get_cascade(FRONTAL_FACE_CASCADE)
+    get_cascade(EYE_CASCADE)
+except FileNotFoundError:
     logger.error("Haar cascade file(s) not found or corrupted.")
-    raise FileNotFoundError("Haar cascade files missing.")
+    raise
 
 def get_image_metadata(image_path):
     try:
@@ -67,23 +128,55 @@ def call_facepp_api(image_path):
         logger.error(f"Face++ API call failed: {e}")
         return {}
 
-def detect_faces(img):
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+def get_face_detector():
+    global _face_detector
+    if _face_detector is None:
+        if FACE_DETECTOR == "dnn":
+            try:
+                _face_detector = DnnFaceDetector(FACE_DNN_MODEL, FACE_DNN_CONFIG)
+            except Exception as e:
+                logger.error(f"DNN face detector unavailable, falling back to Haar: {e}")
+        if _face_detector is None:
+            _face_detector = HaarDetector()
+    return _face_detector
+
+def set_face_detector(detector):
+    global _face_detector
+    _face_detector = detector
+
+def detect_face_boxes(image, scale=None, min_size=None, max_size=None):
+    scale = DETECT_SCALE if scale is None else scale
+    min_size = DETECT_MIN_SIZE if min_size is None else min_size
+    max_size = DETECT_MAX_SIZE if max_size is None else max_size
+    return get_face_detector().detect(image, scale, min_size, max_size)
+
+def find_eyes(gray, face_coords):
+    # On-demand eye stage: only the upper part of each face box is searched. Results are cached per face on the
+    # frame's FrameContext, so pass the context (not its gray view) and repeated calls on one frame reuse them.
+    context = FrameContext.of(gray)
     eyes = []
-    for (x, y, w, h) in faces:
-        roi_gray = gray[y:y + h, x:x + w]
-        detected_eyes = eye_cascade.detectMultiScale(roi_gray)
-        eyes.append([(ex + x, ey + y, ew, eh) for (ex, ey, ew, eh) in detected_eyes])
-    return faces, gray, eyes
+    for (x, y, w, h) in face_coords:
+        key = (int(x), int(y), int(w), int(h))
+        found = context.eyes.get(key)
+        if found is None:
+            roi_gray = context.roi((x, y, w, int(h * EYE_REGION)))
+            detected_eyes = get_cascade(EYE_CASCADE).detectMultiScale(roi_gray, maxSize=(max(1, w // 2), max(1, h // 2)))
+            found = context.eyes[key] = [(ex + x, ey + y, ew, eh) for (ex, ey, ew, eh) in detected_eyes]
+        eyes.append(found)
+    return eyes
+
+def detect_faces(img, detect_eyes=False, scale=None, min_size=None, max_size=None):
+    context = FrameContext.of(img)
+    faces = detect_face_boxes(context, scale, min_size, max_size)
+    eyes = find_eyes(context, faces) if detect_eyes else []
+    return faces, context.gray, eyes
 
-def detect_faces_only(image_path):
+def detect_faces_only(image_path, scale=None, min_size=None, max_size=None):
     img = cv2.imread(image_path)
     if img is None or img.size == 0:
         logger.error("Invalid image file")
         return []
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+    faces = detect_face_boxes(FrameContext(img), scale, min_size, max_size)
     return faces
 
 def draw_faces_and_show(image_path):
@@ -95,49 +188,757 @@ def draw_faces_and_show(image_path):
     cv2.waitKey(0)
     cv2.destroyAllWindows()
 
-def train_model():
-    faces = []
-    labels = []
-    names = []
-    face_samples_dir = os.path.join(project_dir, "face_samples")
-    if not os.path.exists(face_samples_dir):
-        logger.warning("Face samples directory not found.")
-        return None, []
-    people = os.listdir(face_samples_dir)
-    label = 0
-    for person in people:
-        person_dir = os.path.join(face_samples_dir, person)
-        if not os.path.isdir(person_dir):
-            continue
-        names.append(person)
-        for image_name in os.listdir(person_dir):
-            img_path = os.path.join(person_dir, image_name)
-            img = cv2.imread(img_path)
-            if img is None:
-                continue
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            faces_rect, _, _ = detect_faces(img)
-            if len(faces_rect) != 1:
+def sample_fingerprint(samples_dir=face_samples_dir, exclude=None):
+    # Hash of every sample path, size and mtime; cheap compared to decoding the images.
+    digest = hashlib.sha1()
+    skip = {TEMP_SAMPLES_DIR, exclude}
+    for root, dirs, files in os.walk(samples_dir):
+        rel_root = os.path.relpath(root, samples_dir)
+        if rel_root == ".":
+            dirs[:] = sorted(d for d in dirs if d not in skip)
+        else:
+            dirs.sort()
+        for file_name in sorted(files):
+            path = os.path.join(root, file_name)
+            try:
+                st = os.stat(path)
+            except OSError:
                 continue
-            (x, y, w, h) = faces_rect[0]
-            face = gray[y:y + h, x:x + w]
+            rel_path = os.path.relpath(path, samples_dir).replace(os.sep, "/")
+            digest.update(f"{rel_path}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def load_cached_model(fingerprint=None):
+    if not os.path.exists(MODEL_CACHE_FILE) or not os.path.exists(MODEL_META_FILE):
+        return None
+    try:
+        with open(MODEL_META_FILE, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if fingerprint is not None and meta.get("fingerprint") != fingerprint:
+            return None
+        with np.load(MODEL_CACHE_FILE) as data:
+            params = data["params"].tolist()
+            histograms, labels = [data["histograms"]], [data["labels"]]
+        # Subjects enrolled since the last full training are stored one file each
+        for file_name in meta.get("subjects", []):
+            with np.load(os.path.join(os.path.dirname(MODEL_CACHE_FILE), file_name)) as data:
+                histograms.append(data["histograms"])
+                labels.append(data["labels"])
+        radius, neighbors, grid_x, grid_y, threshold = params
+        gallery = LBPHGallery(np.concatenate(histograms), np.concatenate(labels), int(radius), int(neighbors),
+                              int(grid_x), int(grid_y), threshold)
+        return gallery, meta.get("names", [])
+    except Exception as e:
+        logger.warning(f"Failed to load cached model: {e}")
+        return None
+
+def _cached_meta():
+    try:
+        with open(MODEL_META_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def _cached_names():
+    return _cached_meta().get("names", [])
+
+def _write_cache_meta(meta):
+    tmp_meta = MODEL_META_FILE + ".tmp"
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, MODEL_META_FILE)
+
+def save_model_cache(gallery, names, fingerprint):
+    # Write to temp files and rename so a crash never leaves a half-written cache behind.
+    try:
+        os.makedirs(os.path.dirname(MODEL_CACHE_FILE), exist_ok=True)
+        enrolled = _cached_meta().get("subjects", [])
+        tmp_model = MODEL_CACHE_FILE + ".tmp"
+        # Uncompressed: loading is a straight read of the histogram matrix
+        with open(tmp_model, "wb") as f:
+            np.savez(f, histograms=gallery.histograms, labels=gallery.labels,
+                     params=np.array([gallery.radius, gallery.neighbors, gallery.grid_x, gallery.grid_y,
+                                      gallery.threshold], np.float64))
+        # A background retrain runs in another process and does not share _model_lock with enroll_subject(). If
+        # samples changed while it trained, the cache on disk may already hold a newer subject; keep that one.
+        if fingerprint != sample_fingerprint(face_samples_dir):
+            os.remove(tmp_model)
+            logger.info("Face samples changed during training, model cache left as is.")
+            return
+        os.replace(tmp_model, MODEL_CACHE_FILE)
+        _write_cache_meta({"fingerprint": fingerprint, "names": names})
+        # The full gallery includes every enrolled subject, their files are no longer referenced
+        for file_name in enrolled:
+            try:
+                os.remove(os.path.join(os.path.dirname(MODEL_CACHE_FILE), file_name))
+            except OSError:
+                pass
+    except Exception as e:
+        logger.error(f"Failed to save model cache: {e}")
+
+def append_subject_cache(histograms, label, names, fingerprint):
+    # Persists one enrolled subject: its histograms go to their own file and the meta file, renamed into place
+    # last, starts referencing it. The main gallery file is left untouched.
+    try:
+        meta = _cached_meta()
+        subjects = meta.get("subjects", [])
+        if len(histograms):
+            file_name = f"subject_{label}.npz"
+            path = os.path.join(os.path.dirname(MODEL_CACHE_FILE), file_name)
+            with open(path + ".tmp", "wb") as f:
+                np.savez(f, histograms=np.asarray(histograms, np.float32),
+                         labels=np.full(len(histograms), label, np.int32))
+            os.replace(path + ".tmp", path)
+            subjects = subjects + [file_name]
+        _write_cache_meta({"fingerprint": fingerprint, "names": names, "subjects": subjects})
+    except Exception as e:
+        logger.error(f"Failed to save enrolled subject to the model cache: {e}")
+
+def _init_sample_worker():
+    # Each pool process loads its own cascade up front and runs OpenCV single-threaded to avoid oversubscription
+    cv2.setNumThreads(1)
+    get_cascade(FRONTAL_FACE_CASCADE)
+
+def read_crop_manifest(person_dir):
+    try:
+        with open(os.path.join(person_dir, CROP_MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f).get("crops", {})
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable crop manifest in {person_dir}: {e}")
+        return {}
+
+def record_normalized_crops(person_dir, file_names, size):
+    crops = read_crop_manifest(person_dir)
+    for file_name in file_names:
+        crops[file_name] = {"normalized": True, "size": list(size)}
+    manifest_path = os.path.join(person_dir, CROP_MANIFEST)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"crops": crops}, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+def _load_face_sample(img_path, detect_eyes=False, crop_size=None):
+    if crop_size is not None:
+        # Already a normalized grayscale face crop, no need to find the face again
+        face = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+        if face is not None and (face.shape[1], face.shape[0]) == tuple(crop_size):
+            return face
+    img = cv2.imread(img_path)
+    if img is None:
+        return None
+    faces_rect, gray, _ = detect_faces(img, detect_eyes=detect_eyes)
+    if len(faces_rect) != 1:
+        return None
+    (x, y, w, h) = faces_rect[0]
+    return gray[y:y + h, x:x + w]
+
+def _iter_face_samples(samples, workers=None, detect_eyes=False):
+    # samples are (path, crop_size or None); crops are yielded lazily in the same order, so labels stay
+    # deterministic and only one pool batch is decoded ahead of the consumer
+    to_detect = sum(1 for _, crop_size in samples if crop_size is None)
+    if workers == 1 or to_detect < PARALLEL_MIN_SAMPLES:
+        for path, crop_size in samples:
+            yield _load_face_sample(path, detect_eyes, crop_size)
+        return
+    workers = workers or os.cpu_count() or 1
+    batch_size = workers * SAMPLE_BATCH_PER_WORKER
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_sample_worker) as pool:
+        for start in range(0, len(samples), batch_size):
+            batch = samples[start:start + batch_size]
+            yield from pool.map(_load_face_sample, [path for path, _ in batch], repeat(detect_eyes),
+                                [crop_size for _, crop_size in batch], chunksize=max(1, len(batch) // (workers * 4)))
+
+def _load_face_samples(samples, workers=None, detect_eyes=False):
+    return list(_iter_face_samples(samples, workers, detect_eyes))
+
+def _subject_samples(person_dir):
+    manifest = read_crop_manifest(person_dir)
+    samples = []
+    for file_name in sorted(os.listdir(person_dir)):
+        if file_name == CROP_MANIFEST or file_name.endswith(".tmp"):
+            continue
+        entry = manifest.get(file_name, {})
+        crop_size = entry.get("size") if entry.get("normalized") else None
+        samples.append((os.path.join(person_dir, file_name), crop_size))
+    return samples
+
+def _load_subject_faces(person_dir):
+    faces = _load_face_samples(_subject_samples(person_dir), workers=1)
+    return [face for face in faces if face is not None]
+
+def _fit_chunk(model, faces, labels):
+    # First chunk trains the recognizer, later chunks only append their histograms
+    if model is None:
+        model = cv2.face.LBPHFaceRecognizer_create()
+        model.train(faces, np.array(labels))
+    else:
+        model.update(faces, np.array(labels))
+    return model
+
+def _train_from_samples(samples_dir, known_names=(), workers=None, detect_eyes=False,
+                        max_memory_mb=TRAIN_CHUNK_MB, progress=None):
+    people = [p for p in os.listdir(samples_dir)
+              if p != TEMP_SAMPLES_DIR and os.path.isdir(os.path.join(samples_dir, p))]
+    # Keep the labels of already known subjects stable, new ones go at the end
+    names = [n for n in known_names if n in people]
+    names += sorted(p for p in people if p not in names)
+    samples = []
+    img_labels = []
+    for label, person in enumerate(names):
+        person_samples = _subject_samples(os.path.join(samples_dir, person))
+        samples.extend(person_samples)
+        img_labels.extend([label] * len(person_samples))
+    model = None
+    faces, labels, chunk_bytes = [], [], 0
+    chunk_limit = max_memory_mb * 1024 * 1024
+    chunks = trained = 0
+    samples_iter = _iter_face_samples(samples, workers, detect_eyes)
+    for read, (face, label) in enumerate(zip(samples_iter, img_labels), 1):
+        if face is not None:
             faces.append(face)
             labels.append(label)
-        label += 1
-    if not faces:
+            chunk_bytes += face.nbytes
+        if chunk_bytes < chunk_limit and read < len(samples):
+            continue
+        if faces:
+            model = _fit_chunk(model, faces, labels)
+            chunks += 1
+            trained += len(faces)
+            logger.info(f"Training chunk {chunks}: {len(faces)} faces, {read}/{len(samples)} samples read")
+            faces, labels, chunk_bytes = [], [], 0
+        if progress is not None:
+            progress(read, len(samples))
+    if model is None:
         logger.warning("No valid faces for training.")
         return None, []
-    model = cv2.face.LBPHFaceRecognizer_create()
-    model.train(faces, np.array(labels))
-    return model, names
+    logger.info(f"Model trained on {trained} faces in {chunks} chunk(s).")
+    # Only the recognizer's histograms are kept; matching runs on the gallery
+    return LBPHGallery.from_model(model), names
+
+def train_model(use_cache=True, workers=None, detect_eyes=False, max_memory_mb=TRAIN_CHUNK_MB, progress=None):
+    if not os.path.exists(face_samples_dir):
+        logger.warning("Face samples directory not found.")
+        return None, []
+    with _model_lock:
+        fingerprint = sample_fingerprint(face_samples_dir)
+        if use_cache:
+            cached = load_cached_model(fingerprint)
+            if cached is not None:
+                logger.info("Loaded cached model, face samples unchanged.")
+                return cached
+        logger.info("Face samples changed, retraining model.")
+        model, names = _train_from_samples(face_samples_dir, _cached_names(), workers, detect_eyes,
+                                           max_memory_mb, progress)
+        if model is not None:
+            save_model_cache(model, names, fingerprint)
+        return model, names
+
+def enroll_subject(name, gallery=None, names=None, fingerprint=None):
+    # Add one newly registered subject's histograms to the gallery instead of retraining everything. gallery,
+    # names and fingerprint are the caller's live copy; while they match the samples on disk only the new
+    # subject's images are read and only its histograms are written to the cache.
+    person_dir = os.path.join(face_samples_dir, name)
+    if not os.path.isdir(person_dir):
+        logger.error(f"No face samples found for {name}")
+        return None, []
+    with _model_lock:
+        previous = sample_fingerprint(face_samples_dir, exclude=name)
+        if gallery is None or fingerprint != previous or _cached_meta().get("fingerprint") != previous:
+            gallery, names = load_cached_model(previous) or (None, [])
+        if gallery is None or name in names:
+            logger.info(f"Model cache is stale or {name} is already enrolled, running full training.")
+            return train_model()
+        faces = _load_subject_faces(person_dir)
+        label = len(names)
+        names = names + [name]
+        histograms = gallery.histograms_for(faces) if faces else []
+        if faces:
+            gallery = gallery.with_subject(histograms, label)
+        else:
+            logger.warning(f"No valid faces for {name}, subject enrolled without samples.")
+        append_subject_cache(histograms, label, names, sample_fingerprint(face_samples_dir))
+        logger.info(f"Enrolled {name} with label {label} ({len(faces)} samples).")
+        return gallery, names
+
+def _elbp(gray, radius=1, neighbors=8):
+    # Same extended LBP operator as OpenCV's LBPHFaceRecognizer, vectorized over the whole image
+    src = gray.astype(np.float32)
+    rows, cols = src.shape
+    center = src[radius:rows - radius, radius:cols - radius]
+    codes = np.zeros(center.shape, np.int32)
+    eps = np.finfo(np.float32).eps
+    for n in range(neighbors):
+        x = np.float32(radius * np.cos(2.0 * np.pi * n / neighbors))
+        y = np.float32(-radius * np.sin(2.0 * np.pi * n / neighbors))
+        fx, fy = int(np.floor(x)), int(np.floor(y))
+        cx, cy = int(np.ceil(x)), int(np.ceil(y))
+        ty, tx = y - fy, x - fx
+        w1, w2, w3, w4 = (1 - tx) * (1 - ty), tx * (1 - ty), (1 - tx) * ty, tx * ty
+        def shifted(dy, dx):
+            return src[radius + dy:rows - radius + dy, radius + dx:cols - radius + dx]
+        t = w1 * shifted(fy, fx) + w2 * shifted(fy, cx) + w3 * shifted(cy, fx) + w4 * shifted(cy, cx)
+        codes |= (((t > center) | (np.abs(t - center) < eps)).astype(np.int32) << n)
+    return codes
+
+def _spatial_histogram(codes, num_patterns, grid_x, grid_y):
+    cell_h, cell_w = codes.shape[0] // grid_y, codes.shape[1] // grid_x
+    num_cells = grid_x * grid_y
+    if cell_h == 0 or cell_w == 0:
+        return np.zeros(num_cells * num_patterns, np.float32)
+    cells = codes[:cell_h * grid_y, :cell_w * grid_x].reshape(grid_y, cell_h, grid_x, cell_w)
+    cells = cells.transpose(0, 2, 1, 3).reshape(num_cells, cell_h * cell_w)
+    cells = cells + (np.arange(num_cells) * num_patterns)[:, None]
+    hist = np.bincount(cells.ravel(), minlength=num_cells * num_patterns).astype(np.float32)
+    return hist / np.float32(cell_h * cell_w)
+
+def _pairwise_overlap(queries, gallery, metric):
+    # Per pair, sum of min(q, g) for intersection or q*g / (q+g) for chi-square; both are zero wherever q is zero
+    q = queries[:, None, :]
+    g = gallery[None, :, :]
+    if metric == "intersection":
+        return np.minimum(q, g).sum(axis=2)
+    num = q * g
+    den = q + g
+    den += np.float32(1e-30)
+    num /= den
+    return num.sum(axis=2)
+
+def _chunked_distances(queries, gallery, metric, gallery_sums=None):
+    # (faces x gallery samples) distance matrix, computed in gallery chunks to bound memory.
+    #   chi-square:   2 * sum((q-g)^2 / (q+g)) == 2 * (sum(q) + sum(g) - 4 * sum(q*g / (q+g)))
+    #   intersection: sum(|q-g|)               == sum(q) + sum(g) - 2 * sum(min(q, g))
+    # so only the bins that some query actually uses have to be compared.
+    cols = np.flatnonzero(queries.any(axis=0))
+    sparse = len(cols) < 0.75 * queries.shape[1]
+    used_queries = queries[:, cols] if sparse else queries
+    if gallery_sums is None:
+        gallery_sums = gallery.sum(axis=1, dtype=np.float64)
+    factor = 2.0 if metric == "intersection" else 4.0
+    out = np.empty((len(queries), len(gallery)), np.float64)
+    out[:] = queries.sum(axis=1, dtype=np.float64)[:, None] + gallery_sums[None, :]
+    step = max(1, GALLERY_CHUNK_ELEMENTS // max(1, used_queries.size))
+    for start in range(0, len(gallery), step):
+        chunk = gallery[start:start + step]
+        if sparse:
+            chunk = chunk[:, cols]
+        out[:, start:start + step] -= factor * _pairwise_overlap(used_queries, chunk, metric)
+    if metric == "chisqr":
+        out *= 2.0
+    return np.maximum(out, 0.0, out=out)
+
+def _topk_subjects(subject_dist, subject_labels, k):
+    # k nearest subjects per face, best first; argpartition avoids sorting the whole gallery
+    k = max(1, min(k, subject_dist.shape[1]))
+    idx = np.argpartition(subject_dist, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(subject_dist, idx, axis=1)
+    idx = np.take_along_axis(idx, np.argsort(top, axis=1), axis=1)
+    return [[(int(subject_labels[j]), float(subject_dist[row, j])) for j in idx[row] if np.isfinite(subject_dist[row, j])]
+            for row in range(subject_dist.shape[0])]
 
-def recognize_face(model, frame, gray_frame, face_coords, names, eye_coords=None):
+class GalleryQueries:
+    # Query side shared by every gallery: LBP histograms for face crops and thresholded predictions on top of
+    # the subclass's match_histograms(queries, k).
+    def __init__(self, radius=1, neighbors=8, grid_x=8, grid_y=8, threshold=float("inf"), metric="chisqr"):
+        if metric not in ("chisqr", "intersection"):
+            raise ValueError(f"Unknown gallery metric: {metric}")
+        self.radius = radius
+        self.neighbors = neighbors
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.threshold = threshold
+        self.metric = metric
+
+    def histogram(self, face):
+        codes = _elbp(face, self.radius, self.neighbors)
+        return _spatial_histogram(codes, 2 ** self.neighbors, self.grid_x, self.grid_y)
+
+    def histograms_for(self, faces):
+        return np.vstack([self.histogram(face)[None, :] for face in faces])
+
+    def match_topk(self, faces, k=3):
+        if len(faces) == 0:
+            return []
+        return self.match_histograms(self.histograms_for(faces), k)
+
+    def predict_batch(self, faces):
+        results = []
+        for candidates in self.match_topk(faces, k=1):
+            if candidates and candidates[0][1] < self.threshold:
+                results.append(candidates[0])
+            else:
+                results.append((-1, float("inf")))
+        return results
+
+    def predict(self, face):
+        return self.predict_batch([face])[0]
+
+class LBPHGallery(GalleryQueries):
+    # All gallery LBP histograms in one contiguous matrix, matched against every face of a frame at once.
+    # metric "chisqr" matches LBPHFaceRecognizer.predict(); "intersection" ranks by histogram intersection (L1 distance).
+    def __init__(self, histograms, labels, radius=1, neighbors=8, grid_x=8, grid_y=8,
+                 threshold=float("inf"), metric="chisqr"):
+        super().__init__(radius, neighbors, grid_x, grid_y, threshold, metric)
+        labels = np.asarray(labels, np.int32).ravel()
+        order = np.argsort(labels, kind="stable")
+        self.histograms = np.ascontiguousarray(np.asarray(histograms, np.float32)[order])
+        self.labels = labels[order]
+        self.histogram_sums = self.histograms.sum(axis=1, dtype=np.float64)
+        self.subject_labels, self.subject_starts = np.unique(self.labels, return_index=True)
+
+    @classmethod
+    def from_model(cls, model, metric="chisqr", **kwargs):
+        histograms = np.vstack([h.reshape(1, -1) for h in model.getHistograms()])
+        return cls(histograms, model.getLabels(), model.getRadius(), model.getNeighbors(),
+                   model.getGridX(), model.getGridY(), model.getThreshold(), metric, **kwargs)
+
+    @classmethod
+    def from_gallery(cls, gallery, metric=None, **kwargs):
+        return cls(gallery.histograms, gallery.labels, gallery.radius, gallery.neighbors, gallery.grid_x,
+                   gallery.grid_y, gallery.threshold, metric or gallery.metric, **kwargs)
+
+    def with_subject(self, histograms, label):
+        # New gallery with one more subject; label must be above every existing one, so rows stay sorted by label.
+        # The live gallery is never modified, matching threads may still be reading it.
+        gallery = copy.copy(self)
+        histograms = np.asarray(histograms, np.float32)
+        gallery.histograms = np.concatenate([self.histograms, histograms])
+        gallery.labels = np.append(self.labels, np.full(len(histograms), label, np.int32))
+        gallery.histogram_sums = np.append(self.histogram_sums, histograms.sum(axis=1, dtype=np.float64))
+        gallery.subject_labels = np.append(self.subject_labels, np.int32(label))
+        gallery.subject_starts = np.append(self.subject_starts, len(self.labels))
+        return gallery
+
+    def __len__(self):
+        return len(self.labels)
+
+    def distances(self, queries, rows=None):
+        if rows is None:
+            return _chunked_distances(queries, self.histograms, self.metric, self.histogram_sums)
+        return _chunked_distances(queries, self.histograms[rows], self.metric, self.histogram_sums[rows])
+
+    def match_histograms(self, queries, k=3):
+        if len(queries) == 0:
+            return []
+        if len(self.labels) == 0:
+            return [[] for _ in range(len(queries))]
+        dist = self.distances(queries)
+        subject_dist = np.minimum.reduceat(dist, self.subject_starts, axis=1)
+        return _topk_subjects(subject_dist, self.subject_labels, k)
+
+class TwoStageGallery(LBPHGallery):
+    # Coarse-to-fine search for large watchlists: a low-dimensional projection of every histogram shortlists
+    # subjects, and the full LBPH distance only runs on the shortlisted subjects' samples.
+    # projection "pool" sums each cell's 256 LBP bins into pool_bins bins; "pca" projects onto the top components.
+    def __init__(self, *args, shortlist=SHORTLIST_SIZE, projection="pool", pool_bins=16, components=64, **kwargs):
+        super().__init__(*args, **kwargs)
+        if projection not in ("pool", "pca"):
+            raise ValueError(f"Unknown coarse projection: {projection}")
+        self.shortlist = shortlist
+        self.projection = projection
+        self.pool_bins = pool_bins
+        if projection == "pca":
+            self._fit_pca(components)
+        self.coarse = np.ascontiguousarray(self.project(self.histograms))
+        self.coarse_sq = (self.coarse * self.coarse).sum(axis=1)
+
+    def _fit_pca(self, components, seed=0):
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(len(self), PCA_FIT_SAMPLES, replace=False)) if len(self) > PCA_FIT_SAMPLES else slice(None)
+        x = self.histograms[rows]
+        self.pca_mean = x.mean(axis=0)
+        x = x - self.pca_mean
+        components = max(1, min(components, x.shape[0], x.shape[1]))
+        # Randomized range finder, far cheaper than a full SVD of a samples x 16k-bin matrix
+        basis = x @ rng.standard_normal((x.shape[1], min(components + 10, x.shape[0]))).astype(np.float32)
+        for _ in range(2):
+            basis, _ = np.linalg.qr(basis)
+            basis = x @ (x.T @ basis)
+        basis, _ = np.linalg.qr(basis)
+        _, _, vt = np.linalg.svd(basis.T @ x, full_matrices=False)
+        self.pca_components = np.ascontiguousarray(vt[:components], np.float32)
+
+    def project(self, histograms):
+        if self.projection == "pca":
+            return (histograms - self.pca_mean) @ self.pca_components.T
+        factor = max(1, 2 ** self.neighbors // self.pool_bins)
+        return histograms.reshape(len(histograms), -1, factor).sum(axis=2)
+
+    def coarse_distances(self, queries):
+        coarse_q = self.project(queries)
+        if self.projection == "pca":
+            # Squared euclidean distance as a single matrix product
+            return (coarse_q * coarse_q).sum(axis=1)[:, None] + self.coarse_sq[None, :] - 2.0 * (coarse_q @ self.coarse.T)
+        return _chunked_distances(coarse_q, self.coarse, "chisqr")
+
+    def match_histograms(self, queries, k=3, shortlist=None):
+        shortlist = self.shortlist if shortlist is None else shortlist
+        if len(queries) == 0 or not shortlist or shortlist >= len(self.subject_labels):
+            return super().match_histograms(queries, k)
+        subject_coarse = np.minimum.reduceat(self.coarse_distances(queries), self.subject_starts, axis=1)
+        candidates = np.argpartition(subject_coarse, shortlist - 1, axis=1)[:, :shortlist]
+        # One full-distance pass over the union of all faces' shortlists
+        union = np.unique(candidates)
+        ends = np.append(self.subject_starts[1:], len(self.labels))
+        counts = ends[union] - self.subject_starts[union]
+        rows = np.concatenate([np.arange(self.subject_starts[j], ends[j]) for j in union])
+        local_starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        subject_dist = np.minimum.reduceat(self.distances(queries, rows), local_starts, axis=1)
+        own = np.zeros(subject_dist.shape, bool)
+        own[np.arange(len(queries))[:, None], np.searchsorted(union, candidates)] = True
+        subject_dist[~own] = np.inf
+        return _topk_subjects(subject_dist, self.subject_labels[union], k)
+
+def shortlist_recall(gallery, queries, sizes, k=1):
+    # Fraction of the exhaustive top-k subjects that the two-stage search still finds, per shortlist size
+    exhaustive = LBPHGallery.match_histograms(gallery, queries, k)
+    total = sum(len(candidates) for candidates in exhaustive)
+    report = {}
+    for size in sizes:
+        staged = gallery.match_histograms(queries, k, shortlist=size)
+        hits = sum(len({label for label, _ in e} & {label for label, _ in st}) for e, st in zip(exhaustive, staged))
+        report[size] = hits / total if total else 1.0
+        logger.info(f"Shortlist {size}: recall@{k} {report[size]:.3f} vs exhaustive search")
+    return report
+
+def _attach_shared_memory(name):
+    # Workers share the parent's resource tracker, so only the parent's unlink in close() releases the segment
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+def _shard_worker(conn, gallery_name, gallery_shape, query_name, labels, sums, metric):
+    cv2.setNumThreads(1)
+    gallery_shm = _attach_shared_memory(gallery_name)
+    query_shm = _attach_shared_memory(query_name)
+    histograms = np.ndarray(gallery_shape, np.float32, buffer=gallery_shm.buf)
+    queries = np.ndarray((SHARD_MAX_QUERY_FACES, gallery_shape[1]), np.float32, buffer=query_shm.buf)
+    subject_labels, subject_starts = np.unique(labels, return_index=True)
+    try:
+        while True:
+            request = conn.recv()
+            if request is None:
+                break
+            count, k = request
+            dist = _chunked_distances(queries[:count], histograms, metric, sums)
+            subject_dist = np.minimum.reduceat(dist, subject_starts, axis=1)
+            conn.send(_topk_subjects(subject_dist, subject_labels, k))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        del histograms, queries
+        gallery_shm.close()
+        query_shm.close()
+
+def _shutdown_shards(conns, processes, segments):
+    for conn in conns:
+        try:
+            conn.send(None)
+            conn.close()
+        except (OSError, ValueError):
+            pass
+    for process in processes:
+        process.join(timeout=2)
+        if process.is_alive():
+            process.terminate()
+    for shm in segments:
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+class ShardedGallery(GalleryQueries):
+    # Subjects are partitioned across worker processes, each holding its shard of histograms in shared memory.
+    # Query histograms are written to a shared buffer, every shard matches them in parallel and the per-shard
+    # top-k lists are merged. Same matching interface as LBPHGallery, so recognize_face() uses it unchanged.
+    def __init__(self, gallery, shards=None):
+        shards = max(1, min(shards or os.cpu_count() or 1, len(gallery.subject_labels)))
+        super().__init__(gallery.radius, gallery.neighbors, gallery.grid_x, gallery.grid_y, gallery.threshold,
+                         gallery.metric)
+        self.subject_labels = gallery.subject_labels
+        self._size = len(gallery)
+        self._lock = threading.Lock()
+        self._conns = []
+        self._processes = []
+        self._segments = []
+        dims = gallery.histograms.shape[1]
+        self._query_shm = shared_memory.SharedMemory(create=True, size=SHARD_MAX_QUERY_FACES * dims * 4)
+        self._segments.append(self._query_shm)
+        self._queries = np.ndarray((SHARD_MAX_QUERY_FACES, dims), np.float32, buffer=self._query_shm.buf)
+        # Split at subject boundaries so every shard holds roughly the same number of samples
+        bounds = np.searchsorted(gallery.subject_starts, np.linspace(0, len(gallery), shards + 1)[1:-1])
+        starts = np.append(gallery.subject_starts, len(gallery))
+        row_bounds = [0] + [int(starts[b]) for b in bounds] + [len(gallery)]
+        ctx = multiprocessing.get_context()
+        for lo, hi in zip(row_bounds[:-1], row_bounds[1:]):
+            if hi <= lo:
+                continue
+            shm = shared_memory.SharedMemory(create=True, size=(hi - lo) * dims * 4)
+            self._segments.append(shm)
+            np.ndarray((hi - lo, dims), np.float32, buffer=shm.buf)[:] = gallery.histograms[lo:hi]
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=_shard_worker, daemon=True,
+                                  args=(child_conn, shm.name, (hi - lo, dims), self._query_shm.name,
+                                        gallery.labels[lo:hi], gallery.histogram_sums[lo:hi], self.metric))
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+        self._finalizer = weakref.finalize(self, _shutdown_shards, self._conns, self._processes, self._segments)
+        logger.info(f"Sharded gallery: {self._size} samples across {len(self._processes)} worker processes.")
+
+    def __len__(self):
+        return self._size
+
+    def close(self):
+        self._finalizer()
+
+    def match_histograms(self, queries, k=3):
+        results = []
+        with self._lock:
+            for start in range(0, len(queries), SHARD_MAX_QUERY_FACES):
+                batch = queries[start:start + SHARD_MAX_QUERY_FACES]
+                self._queries[:len(batch)] = batch
+                for conn in self._conns:
+                    conn.send((len(batch), k))
+                shard_results = [conn.recv() for conn in self._conns]
+                for row in range(len(batch)):
+                    merged = [candidate for shard in shard_results for candidate in shard[row]]
+                    results.append(sorted(merged, key=lambda c: c[1])[:k])
+        return results
+
+def build_matcher(gallery, metric="chisqr", shortlist=SHORTLIST_SIZE, shards=None):
+    # gallery is the LBPHGallery returned by train_model(); an LBPHFaceRecognizer is accepted as well
+    if gallery is None:
+        return None
+    if not isinstance(gallery, LBPHGallery):
+        gallery = LBPHGallery.from_model(gallery, metric)
+    elif gallery.metric != metric:
+        gallery = LBPHGallery.from_gallery(gallery, metric)
+    if shards != 1 and (shards or len(gallery) >= SHARDED_MIN_SAMPLES):
+        return ShardedGallery(gallery, shards)
+    if shortlist and len(gallery.subject_labels) > TWO_STAGE_MIN_SUBJECTS:
+        return TwoStageGallery.from_gallery(gallery, shortlist=shortlist)
+    return gallery
+
+ModelSnapshot = collections.namedtuple("ModelSnapshot", "version model names fingerprint")
+
+def _retrain_in_background():
+    train_model()
+
+class ModelManager:
+    # Owns the live (matcher, names) pair. Retraining runs in a separate process and the result is published
+    # as a new versioned snapshot; surveillance loops call snapshot() once per frame, so they switch to the new
+    # model between frames without pausing.
+    def __init__(self, metric="chisqr"):
+        self.metric = metric
+        self._snapshot = ModelSnapshot(0, None, [], None)
+        # Plain LBPHGallery behind the published matcher, extended in place of a reload when a subject is enrolled
+        self._gallery = None
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pending = False
+
+    def snapshot(self):
+        return self._snapshot
+
+    def _publish(self, gallery, names, fingerprint):
+        matcher = build_matcher(gallery, self.metric)
+        with self._lock:
+            self._gallery = gallery
+            version = self._snapshot.version + 1
+            # A single attribute store; readers see either the old or the new snapshot, never a mix
+            self._snapshot = ModelSnapshot(version, matcher, names, fingerprint)
+        logger.info(f"Published model version {version} ({len(names)} subjects).")
+
+    def ensure_loaded(self):
+        # First use trains (or loads the cache) synchronously; afterwards changes are picked up in the background
+        if self._snapshot.model is None:
+            model, names = train_model()
+            if model is not None:
+                self._publish(model, names, _cached_meta().get("fingerprint"))
+        elif self._snapshot.fingerprint != sample_fingerprint(face_samples_dir):
+            self.refresh()
+        return self._snapshot
+
+    def refresh(self):
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                self._pending = True
+                return
+            self._worker = threading.Thread(target=self._retrain_loop, daemon=True)
+            self._worker.start()
+
+    def _retrain_loop(self):
+        while True:
+            # Spawned, not forked: a fork taken while enroll() holds _model_lock would hand the child a lock
+            # owned by a thread that does not exist there, and train_model() would block on it forever
+            process = multiprocessing.get_context("spawn").Process(target=_retrain_in_background, daemon=True)
+            process.start()
+            process.join(RETRAIN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join(5)
+                logger.error(f"Background retraining did not finish within {RETRAIN_TIMEOUT}s and was stopped")
+            elif process.exitcode == 0:
+                self._publish_cache()
+            else:
+                logger.error(f"Background retraining failed with exit code {process.exitcode}")
+            with self._lock:
+                if not self._pending:
+                    self._worker = None
+                    return
+                self._pending = False
+
+    def _publish_cache(self):
+        # Under _model_lock, so an enroll() in this process cannot write the cache between the checks and the load
+        with _model_lock:
+            fingerprint = _cached_meta().get("fingerprint")
+            if fingerprint == self._snapshot.fingerprint:
+                return
+            if fingerprint != sample_fingerprint(face_samples_dir):
+                # Older than the samples on disk, e.g. overwritten by a retrain that started before an
+                # enrollment; the live snapshot stays and the next ensure_loaded() retrains
+                logger.warning("Model cache is older than the face samples, not publishing it.")
+                return
+            cached = load_cached_model(fingerprint)
+            if cached is not None:
+                self._publish(*cached, fingerprint)
+
+    def enroll(self, name):
+        # Incremental enrollment is cheap enough for a thread; it publishes as soon as the subject is added
+        def task():
+            with _model_lock:
+                snapshot = self._snapshot
+                gallery, names = enroll_subject(name, self._gallery, snapshot.names, snapshot.fingerprint)
+                if gallery is not None:
+                    self._publish(gallery, names, _cached_meta().get("fingerprint"))
+        threading.Thread(target=task, daemon=True).start()
+
+def match_faces(model, gray_frame, face_coords, k=1):
+    # Per face, the k nearest (label, distance) candidates in one pass over the gallery
+    faces = FrameContext.of(gray_frame).rois(face_coords)
+    if not hasattr(model, "match_topk"):
+        if k == 1:
+            return [[model.predict(face)] for face in faces]
+        model = LBPHGallery.from_model(model)
+    return model.match_topk(faces, k)
+
+def recognize_face_topk(model, gray_frame, face_coords, names, k=3):
+    results = []
+    for candidates in match_faces(model, gray_frame, face_coords, k):
+        results.append([(names[label] if 0 <= label < len(names) else "Unknown", distance)
+                        for label, distance in candidates])
+    return results
+
+def recognize_face(model, frame, gray_frame, face_coords, names, eye_coords=None, threshold=RECOGNITION_THRESHOLD):
     recognized = []
+    matches = match_faces(model, gray_frame, face_coords, k=1)
     for i, (x, y, w, h) in enumerate(face_coords):
-        face = gray_frame[y:y+h, x:x+w]
-        label, confidence = model.predict(face)
-        if confidence < 100:
-            name = names[label] if label < len(names) else "Unknown"
+        label, confidence = matches[i][0] if matches[i] else (-1, float("inf"))
+        if confidence < threshold:
+            name = names[label] if 0 <= label < len(names) else "Unknown"
             recognized.append((name, confidence))
             cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
             cv2.putText(frame, f"{name} ({confidence:.2f})", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
@@ -146,6 +947,42 @@ def recognize_face(model, frame, gray_frame, face_coords, names, eye_coords=None
             cv2.putText(frame, "Unknown", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
     return frame, recognized
 
+def analyse_frame(frame, detect=True, scale=None):
+    # Stateless half of track_faces(), safe to run on several frames in parallel. Returns the frame's
+    # FrameContext, which later stages (recognition, eyes, liveness) take in place of a gray image.
+    context = FrameContext.of(frame)
+    # Materialized now, before later stages draw boxes and labels onto the frame itself
+    context.gray
+    detections = detect_face_boxes(context, scale) if detect else None
+    return context, detections
+
+def track_faces(tracker, frame, scale=None):
+    # Runs the detector only on the frames the tracker asks for; other frames reuse the tracked boxes
+    context, detections = analyse_frame(frame, tracker.needs_detection(), scale)
+    return tracker.update(detections), context
+
+def recognize_tracks(model, frame, gray_frame, tracker, names, version=None, threshold=RECOGNITION_THRESHOLD):
+    # recognize_face() for tracked faces: only new or uncertain tracks are matched, the rest keep their identity
+    tracker.set_model_version(version)
+    pending = tracker.to_identify()
+    if pending and model is not None:
+        matches = match_faces(model, gray_frame, [track.box for track in pending], k=1)
+        for track, candidates in zip(pending, matches):
+            label, confidence = candidates[0] if candidates else (-1, float("inf"))
+            name = names[label] if confidence < threshold and 0 <= label < len(names) else None
+            tracker.assign(track, label, name, confidence, confidence >= threshold - UNCERTAIN_MARGIN)
+    recognized = []
+    for track in tracker.active():
+        (x, y, w, h) = track.box
+        if track.name is not None:
+            recognized.append((track.name, track.confidence))
+            cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+            cv2.putText(frame, f"{track.name} ({track.confidence:.2f})", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+        else:
+            cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 0, 255), 2)
+            cv2.putText(frame, "Unknown", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
+    return frame, recognized
+
 def run_osint_analysis(image_path):
     logger.info(f"Running OSINT analysis for {image_path}")
     results = {}
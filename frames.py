@@ -0,0 +1,46 @@
+import cv2
+
+# Per-frame cache of derived images. Stages ask the context instead of converting the frame themselves, so the
+# grayscale conversion, histogram equalization and each downscaled copy happen at most once per frame; ROIs
+# are NumPy views into those images, never copies. Derived images must be treated as read-only.
+class FrameContext:
+    def __init__(self, frame):
+        self.frame = frame
+        self._gray = None
+        self._equalized = None
+        self._downscaled = {}
+        # Eye detections per face box, filled by facerec.find_eyes()
+        self.eyes = {}
+
+    @classmethod
+    def of(cls, image):
+        # Accepts a context, a BGR frame or an already-gray image (which becomes its own gray view)
+        return image if isinstance(image, cls) else cls(image)
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            self._gray = self.frame if self.frame.ndim == 2 else cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def equalized(self):
+        if self._equalized is None:
+            self._equalized = cv2.equalizeHist(self.gray)
+        return self._equalized
+
+    def downscaled(self, scale):
+        if scale >= 1.0:
+            return self.gray
+        small = self._downscaled.get(scale)
+        if small is None:
+            small = self._downscaled[scale] = cv2.resize(self.gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return small
+
+    def roi(self, box, view="gray"):
+        (x, y, w, h) = box
+        image = self.frame if view == "color" else getattr(self, view)
+        return image[y:y+h, x:x+w]
+
+    def rois(self, boxes, view="gray"):
+        return [self.roi(box, view) for box in boxes]
@@ -10,7 +10,12 @@ import csv
 import ntpath
 import numpy as np
 import cv2
-from facerec import detect_faces, train_model, recognize_face, run_osint_analysis
+from facerec import detect_faces, find_eyes, ModelManager, recognize_face, analyse_frame, recognize_tracks, run_osint_analysis
+from tracking import FaceTracker
+from attributes import AttributeAnalyzer
+from display import DisplaySink
+from liveness import LivenessMonitor
+from pipeline import VideoPipeline, MotionGate, QualityController, EventLatencyProbe
 
 import json
 import os
@@ -20,6 +25,7 @@ from reportlab.lib import colors
 import requests
 import queue
 import sys
+import tempfile
 import base64
 import subprocess
 from datetime import datetime
@@ -60,7 +66,12 @@ left_frame = None
 right_frame = None
 heading = None
 webcam = None
+webcam_pipeline = None
+webcam_frame = None
+attribute_analyzer = None
+liveness = LivenessMonitor()
 img_label = None
+display_sink = DisplaySink()
 img_read = None
 img_list = []
 slide_caption = None
@@ -71,25 +82,28 @@ message_queue = queue.Queue()
 dashboard_labels = []
 capture_button = None
 progress_bar = None
-
-# Initialize Tkinter root
-root = tk.Tk()
-root.geometry("1500x900+0+0")
-root.title("Criminal Face Identification and OSINT Analysis System")
-style = ttk.Style()
-style.theme_use('clam')
-style.configure('TButton', font=('Arial', 15, 'bold'), background='#2196f3', foreground='white')
-style.map('TButton', background=[('active', '#091428')], foreground=[('active', 'white')])
-style.configure('TLabel', background='#202d42', foreground='white', font=('Arial', 15))
-style.configure('TFrame', background='#202d42')
-root.configure(bg='#202d42')
-
-# Create Pages
-pages = []
-for i in range(6):
-    pages.append(tk.Frame(root, bg="#202d42"))
-    pages[i].pack(side="top", fill="both", expand=True)
-    pages[i].place(x=0, y=0, relwidth=1, relheight=1)
+model_manager = ModelManager()
+
+# Worker processes spawned by facerec re-import this module, so the GUI is only built when run directly
+if __name__ == "__main__":
+    # Initialize Tkinter root
+    root = tk.Tk()
+    root.geometry("1500x900+0+0")
+    root.title("Criminal Face Identification and OSINT Analysis System")
+    style = ttk.Style()
+    style.theme_use('clam')
+    style.configure('TButton', font=('Arial', 15, 'bold'), background='#2196f3', foreground='white')
+    style.map('TButton', background=[('active', '#091428')], foreground=[('active', 'white')])
+    style.configure('TLabel', background='#202d42', foreground='white', font=('Arial', 15))
+    style.configure('TFrame', background='#202d42')
+    root.configure(bg='#202d42')
+
+    # Create Pages
+    pages = []
+    for i in range(6):
+        pages.append(tk.Frame(root, bg="#202d42"))
+        pages[i].pack(side="top", fill="both", expand=True)
+        pages[i].place(x=0, y=0, relwidth=1, relheight=1)
 
 def process_message_queue():
     try:
@@ -101,9 +115,15 @@ def process_message_queue():
     root.after(100, process_message_queue)
 
 def goBack():
-    global active_page, thread_event, webcam, img_label, capture_button, progress_bar
+    global active_page, thread_event, webcam, webcam_pipeline, img_label, capture_button, progress_bar
+    if active_page == 3 and thread_event is not None:
+        thread_event.set()
     if active_page == 4 and webcam is not None:
-        if isinstance(webcam, cv2.VideoCapture) and webcam.isOpened():
+        if webcam_pipeline is not None:
+            # The capture thread releases the camera once it stops
+            webcam_pipeline.stop()
+            webcam_pipeline = None
+        elif isinstance(webcam, cv2.VideoCapture) and webcam.isOpened():
             webcam.release()
         webcam = None
         if img_label is not None and img_label.winfo_exists():
@@ -120,13 +140,22 @@ def goBack():
     pages[0].lift()
     active_page = 0
     # Cleanup temporary files
-    for temp_file in ['temp_capture.png', 'temp_voice.wav']:
+    for temp_file in ['temp_voice.wav']:
         if os.path.exists(temp_file):
             try:
                 os.remove(temp_file)
             except:
                 pass
 
+def close_app():
+    # The webcam pipeline's capture thread owns the camera and releases it once stopped; releasing it here,
+    # from the Tk thread, could race with a read in progress
+    if webcam_pipeline is not None:
+        webcam_pipeline.stop()
+    elif webcam is not None and webcam.isOpened():
+        webcam.release()
+    root.quit()
+
 def basicPageSetup(pageNo):
     global left_frame, right_frame, heading, progress_bar
     if left_frame is not None and left_frame.winfo_exists():
@@ -170,15 +199,12 @@ def showImage(frame, img_size):
             img_size = (left_frame.winfo_width() - 40, left_frame.winfo_height() - 40)
         if img_size[0] <= 0 or img_size[1] <= 0:
             img_size = (460, 460)
-        img = cv2.resize(frame, img_size, interpolation=cv2.INTER_AREA)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(img)
-        img = ImageTk.PhotoImage(img)
+        img = display_sink.show(frame, tuple(img_size))
         if img_label is None:
             img_label = ttk.Label(left_frame, image=img)
             img_label.image = img
             img_label.pack(padx=20)
-        else:
+        elif img_label.image is not img:
             img_label.configure(image=img)
             img_label.image = img
     except cv2.error as e:
@@ -317,6 +343,7 @@ def register(entries, required, menu_var):
             if os.path.exists(final_path):
                 shutil.rmtree(final_path, ignore_errors=True)
             shutil.move(path, final_path)
+            model_manager.enroll(entry_data["Name"])
             criminal_data_dir = os.path.join(project_dir, "criminal_data")
             try:
                 os.makedirs(criminal_data_dir, exist_ok=True)
@@ -484,6 +511,12 @@ def showCriminalProfile(name):
             ttk.Label(info_frame, text=val.capitalize(), font=('Arial', 15)).grid(row=i, column=2, sticky='w')
     ttk.Button(info_frame, text="Generate PDF Report", command=lambda: generate_pdf_report(name, crim_data)).grid(row=len(crim_data)+1, column=0, columnspan=3, pady=20)
 
+def liveness_text(verdict):
+    # LivenessMonitor verdicts: True, False, or None while the face has too little history to judge
+    if verdict is None:
+        return "Pending"
+    return "Live" if verdict else "Spoof Detected"
+
 def show_recognition_popup(recognized, is_live, attributes, osint_result, google_results, facepp_results):
     popup = tk.Toplevel(bg="#202d42")
     popup.title("Recognition Details")
@@ -503,7 +536,7 @@ def show_recognition_popup(recognized, is_live, attributes, osint_result, google
     for i, crim in enumerate(recognized):
         ttk.Label(scroll_frame, text=f"Criminal {i+1}: {crim[0]} (Confidence: {crim[1]:.2f})", font=('Arial', 12, 'bold')).grid(row=row, column=0, pady=5, sticky='w')
         row += 1
-        ttk.Label(scroll_frame, text=f"Liveness: {'Live' if is_live else 'Spoof Detected'}", font=('Arial', 12)).grid(row=row, column=0, pady=2, sticky='w')
+        ttk.Label(scroll_frame, text=f"Liveness: {'N/A (still image)' if is_live is None else liveness_text(is_live)}", font=('Arial', 12)).grid(row=row, column=0, pady=2, sticky='w')
         row += 1
         if attributes:
             ttk.Label(scroll_frame, text=f"Age: {attributes.get('age', 'N/A')}", font=('Arial', 12)).grid(row=row, column=0, pady=2, sticky='w')
@@ -566,28 +599,25 @@ def startRecognition():
                 return
             frame = cv2.resize(frame, (460, 460), interpolation=cv2.INTER_AREA)
             print("Detecting faces...")
-            face_coords, gray_frame, eye_coords = detect_faces(frame)
+            face_coords, gray_frame, _ = detect_faces(frame)
             print(f"Detected faces: {len(face_coords)} coordinates: {face_coords}")
             if not face_coords:  # Safe check for empty array/list
                 message_queue.put("Image doesn't contain any face or face is too small.")
             else:
-                print("Training model...")
-                (model, names) = train_model()
-                print(f"Model trained. Names: {names}")
+                print("Loading model...")
+                (_, model, names, _) = model_manager.ensure_loaded()
+                print(f"Model loaded. Names: {names}")
                 if model is None:
                     message_queue.put("Model training failed.")
                     return
                 print("Recognizing faces...")
-                (frame, recognized) = recognize_face(model, frame, gray_frame, face_coords, names, eye_coords)
-                is_live = check_liveness(frame, face_coords[0], eye_coords[0] if eye_coords and len(eye_coords) > 0 else [])
+                (frame, recognized) = recognize_face(model, frame, gray_frame, face_coords, names)
+                # Liveness needs motion across frames; a still image has none, so it is not judged
+                is_live = None
                 attributes = analyze_face_attributes(frame, face_coords[0]) if face_coords and len(face_coords) > 0 else {}
                 img_size = (left_frame.winfo_width() - 40, left_frame.winfo_height() - 40)
                 frame = cv2.flip(frame, 1, 0)
-                cv2.imwrite("temp_capture.png", frame)
-                osint_result = run_osint_search("temp_capture.png", recognized[0][0] if recognized else "")
-                google_results = run_google_search("temp_capture.png")
-                facepp_results = run_facepp_analysis("temp_capture.png")
-                save_api_results("temp_capture.png", google_results, facepp_results)
+                osint_result, google_results, facepp_results = run_api_lookups(frame, recognized[0][0] if recognized else "")
                 root.after(0, lambda: showImage(frame, img_size))
                 if not recognized:  # Safe check for empty recognized list
                     message_queue.put("No criminal recognized.")
@@ -759,23 +789,6 @@ def getPage2():
         recognize_btn.config(state='normal')
     root.bind('<Configure>', lambda e: enable_recognize() if img_read is not None else None)
 
-def check_liveness(frame, face_coord, eye_coords=[]):
-    # Enhanced liveness check using eye detection and motion
-    if not hasattr(check_liveness, 'prev_frame'):
-        check_liveness.prev_frame = None
-    if not eye_coords or len(eye_coords) < 2:  # Require at least two eyes
-        return False
-    if check_liveness.prev_frame is None:
-        check_liveness.prev_frame = frame.copy()
-        return True
-    # Motion detection
-    diff = cv2.absdiff(check_liveness.prev_frame, frame)
-    motion_score = np.sum(diff) / (frame.shape[0] * frame.shape[1])
-    # Eye presence check
-    eye_count = len(eye_coords)
-    check_liveness.prev_frame = frame.copy()
-    return motion_score > 50.0 and eye_count >= 2
-
 def analyze_face_attributes(frame, face_coord):
     try:
         from deepface import DeepFace
@@ -843,8 +856,65 @@ def run_osint_analysis(image_path):
         print(f"OSINT search failed: {str(e)}")
     return osint_result
 
-def run_webcam(model, names, img_size=(600, 500)):
-    global webcam, img_label, left_frame, right_frame, capture_button
+def run_api_lookups(frame, first_match):
+    # OSINT, Google and Face++ lookups for one frame. Each call uploads its own temporary copy of the frame, so
+    # lookups running at the same time never send or delete each other's image.
+    fd, image_path = tempfile.mkstemp(prefix="capture_", suffix=".png")
+    os.close(fd)
+    try:
+        cv2.imwrite(image_path, frame)
+        osint_result = run_osint_search(image_path, first_match)
+        google_results = run_google_search(image_path)
+        facepp_results = run_facepp_analysis(image_path)
+        save_api_results(image_path, google_results, facepp_results)
+        return osint_result, google_results, facepp_results
+    finally:
+        try:
+            os.remove(image_path)
+        except OSError:
+            pass
+
+def run_osint_lookup(frame, first_match, results):
+    # Blocking HTTP lookups for a live match; runs on its own thread and hands the results to the UI via the
+    # webcam session's results queue
+    try:
+        results.put(run_api_lookups(frame, first_match))
+    except Exception as e:
+        message_queue.put(f"Error processing webcam frame: {str(e)}")
+
+def show_osint_results(osint_result, google_results, facepp_results):
+    osint_label = ttk.Label(right_frame, text="OSINT Results:", font=('Arial', 12, 'bold'), foreground="yellow")
+    osint_label.pack(padx=20, pady=5)
+    if osint_result["metadata"]:
+        for key, value in osint_result["metadata"].items():
+            ttk.Label(right_frame, text=f"{key}: {value}", font=('Arial', 12)).pack(padx=20, pady=2)
+    if osint_result["search_results"]:
+        for i, link in enumerate(osint_result["search_results"], 1):
+            ttk.Label(right_frame, text=f"{i}. {link}", font=('Arial', 12), foreground="blue", cursor="hand2").pack(padx=20, pady=2)
+    else:
+        ttk.Label(right_frame, text="No OSINT matches found.", font=('Arial', 12)).pack(padx=20, pady=2)
+    google_label = ttk.Label(right_frame, text="Google Results:", font=('Arial', 12, 'bold'), foreground="yellow")
+    google_label.pack(padx=20, pady=5)
+    if google_results:
+        for result in google_results[:3]:
+            ttk.Label(right_frame, text=f"URL: {result['link']}", font=('Arial', 12), foreground="blue", cursor="hand2").pack(padx=20, pady=2)
+    else:
+        ttk.Label(right_frame, text="No Google matches found.", font=('Arial', 12)).pack(padx=20, pady=2)
+    facepp_label = ttk.Label(right_frame, text="Face++ Analysis:", font=('Arial', 12, 'bold'), foreground="yellow")
+    facepp_label.pack(padx=20, pady=5)
+    if facepp_results:
+        for key, value in facepp_results.items():
+            ttk.Label(right_frame, text=f"{key}: {value}", font=('Arial', 12)).pack(padx=20, pady=2)
+    else:
+        ttk.Label(right_frame, text="No Face++ analysis available.", font=('Arial', 12)).pack(padx=20, pady=2)
+
+def run_webcam(models, img_size=(600, 500)):
+    # Capture and inference run on pipeline threads and OSINT lookups on their own threads; the Tk loop only
+    # picks up the latest annotated frame, so the GUI stays responsive whatever inference costs
+    global webcam, webcam_pipeline, attribute_analyzer, img_label, left_frame, right_frame, capture_button
+    # Started before the camera so the attribute models warm up while it opens
+    if attribute_analyzer is None:
+        attribute_analyzer = AttributeAnalyzer()
     max_attempts = 3
     for attempt in range(max_attempts):
         webcam = cv2.VideoCapture(0)
@@ -855,102 +925,120 @@ def run_webcam(model, names, img_size=(600, 500)):
         message_queue.put("Failed to access camera after multiple attempts. Check connection or permissions.")
         return
     old_recognized = []
+    old_verdicts = {}
     crims_found_labels = []
+    # Per session: a lookup that finishes after this session stopped is dropped with it, not shown in the next one
+    osint_results = queue.Queue()
+    tracker = FaceTracker()
+    quality = QualityController()
+    quality.apply(tracker)
+    latency = EventLatencyProbe(root.after)
     if capture_button is None or not capture_button.winfo_exists():
         capture_button = ttk.Button(left_frame, text="Capture", command=capture_image)
         capture_button.pack(pady=10)
+
+    def prepare(frame):
+        global webcam_frame
+        webcam_frame = frame
+        frame = cv2.flip(frame, 1)
+        return cv2.resize(frame, img_size, interpolation=cv2.INTER_AREA)
+
+    def analyse(index, frame):
+        return time.perf_counter(), analyse_frame(frame, tracker.detects_frame(index), quality.scale)
+
+    def combine(index, frame, analysis):
+        started, (context, detections) = analysis
+        tracks = tracker.update(detections)
+        face_coords = [track.box for track in tracks]
+        recognized, is_live, attributes = [], {}, {}
+        if len(face_coords) > 0:
+            # Looked up before boxes are drawn on the frame; keyed by identity once known, else by track
+            attributes = attribute_analyzer.lookup(tracks[0].name or f"track-{tracks[0].track_id}", context.roi(face_coords[0], "color"))
+            snapshot = models.snapshot()
+            frame, recognized = recognize_tracks(snapshot.model, frame, context, tracker, snapshot.names, snapshot.version)
+            # Every face gets its own liveness verdict, reported per recognized name
+            eye_coords = find_eyes(context, face_coords)
+            live = liveness.check(context, face_coords, [f"track-{track.track_id}" for track in tracks], eye_coords)
+            is_live = {track.name: verdict for track, verdict in zip(tracks, live) if track.name is not None}
+        if quality.record(time.perf_counter() - started):
+            quality.apply(tracker)
+            print(f"Live quality changed: {quality.summary()}")
+        cv2.putText(frame, quality.summary(), (10, frame.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+        return frame, len(face_coords), recognized, is_live, attributes
+
+    pipeline = webcam_pipeline = VideoPipeline(webcam, prepare, analyse, combine, workers=1, queue_size=1, realtime=False).start()
+    latency.start()
+
     def update_frame():
-        global webcam
-        if webcam is None or not webcam.isOpened():
-            message_queue.put("Webcam disconnected or not accessible.")
-            return
-        ret, frame = webcam.read()
-        if not ret or frame is None or frame.size == 0:
-            message_queue.put("Failed to capture video frame. Camera may be disconnected.")
-            webcam.release()
-            return
         try:
-            frame = cv2.flip(frame, 1)
-            frame = cv2.resize(frame, img_size, interpolation=cv2.INTER_AREA)
-            if frame is None or frame.size == 0:
-                message_queue.put("Invalid frame received from webcam.")
+            if webcam_pipeline is not pipeline or not root.winfo_exists():
+                pipeline.stop()
+                latency.stop()
+                print(f"Webcam stopped: {latency.summary()}")
                 return
-            face_coords, gray_frame, eye_coords = detect_faces(frame)
-            if len(face_coords) > 0:
-                frame, recognized = recognize_face(model, frame, gray_frame, face_coords, names, eye_coords)
-                is_live = check_liveness(frame, face_coords[0], eye_coords[0] if eye_coords and len(eye_coords) > 0 else [])
-                attributes = analyze_face_attributes(frame, face_coords[0]) if face_coords and len(face_coords) > 0 else {}
+            while True:
+                try:
+                    show_osint_results(*osint_results.get_nowait())
+                except queue.Empty:
+                    break
+            result = pipeline.results.get_latest()
+            if result is not None:
+                frame, face_count, recognized, is_live, attributes = result
+                if face_count == 0:
+                    message_queue.put("No faces detected in the current frame.")
                 recog_names = [item[0] for item in recognized]
-                if recog_names != old_recognized:
+                def crim_label_text(crim):
+                    label_text = f"{crim[0]} (Confidence: {crim[1]:.2f})"
+                    label_text += f"\nLiveness: {liveness_text(is_live.get(crim[0]))}"
+                    if attributes:
+                        label_text += f"\nAge: {attributes.get('age', 'N/A')}, Gender: {attributes.get('gender', 'N/A')}"
+                    return label_text
+                if face_count > 0 and recog_names == old_recognized and is_live != old_verdicts:
+                    # Same people, new liveness verdicts: update the labels in place, without a new OSINT lookup
+                    for label, crim in zip(crims_found_labels, recognized):
+                        label.configure(text=crim_label_text(crim))
+                    old_verdicts.clear()
+                    old_verdicts.update(is_live)
+                if face_count > 0 and recog_names != old_recognized:
                     for label in crims_found_labels:
                         label.destroy()
                     crims_found_labels.clear()
                     if recognized:
                         for i, crim in enumerate(recognized):
-                            label_text = f"{crim[0]} (Confidence: {crim[1]:.2f})"
-                            label_text += f"\nLiveness: {'Live' if is_live else 'Spoof Detected'}"
-                            if attributes:
-                                label_text += f"\nAge: {attributes.get('age', 'N/A')}, Gender: {attributes.get('gender', 'N/A')}"
-                            label = ttk.Label(right_frame, text=label_text, foreground="white", background="orange", font=('Arial', 15, 'bold'))
+                            label = ttk.Label(right_frame, text=crim_label_text(crim), foreground="white", background="orange", font=('Arial', 15, 'bold'))
                             label.pack(fill="x", padx=20, pady=10)
                             if label.winfo_exists():
                                 label.bind("<Button-1>", lambda e, name=crim[0]: showCriminalProfile(name))
                             crims_found_labels.append(label)
-                        first_match = recognized[0][0]
-                        cv2.imwrite("temp_capture.png", frame)
-                        osint_result = run_osint_search("temp_capture.png", first_match)
-                        google_results = run_google_search("temp_capture.png")
-                        facepp_results = run_facepp_analysis("temp_capture.png")
-                        save_api_results("temp_capture.png", google_results, facepp_results)
-                        osint_label = ttk.Label(right_frame, text="OSINT Results:", font=('Arial', 12, 'bold'), foreground="yellow")
-                        osint_label.pack(padx=20, pady=5)
-                        if osint_result["metadata"]:
-                            for key, value in osint_result["metadata"].items():
-                                ttk.Label(right_frame, text=f"{key}: {value}", font=('Arial', 12)).pack(padx=20, pady=2)
-                        if osint_result["search_results"]:
-                            for i, link in enumerate(osint_result["search_results"], 1):
-                                ttk.Label(right_frame, text=f"{i}. {link}", font=('Arial', 12), foreground="blue", cursor="hand2").pack(padx=20, pady=2)
-                        else:
-                            ttk.Label(right_frame, text="No OSINT matches found.", font=('Arial', 12)).pack(padx=20, pady=2)
-                        google_label = ttk.Label(right_frame, text="Google Results:", font=('Arial', 12, 'bold'), foreground="yellow")
-                        google_label.pack(padx=20, pady=5)
-                        if google_results:
-                            for result in google_results[:3]:
-                                ttk.Label(right_frame, text=f"URL: {result['link']}", font=('Arial', 12), foreground="blue", cursor="hand2").pack(padx=20, pady=2)
-                        else:
-                            ttk.Label(right_frame, text="No Google matches found.", font=('Arial', 12)).pack(padx=20, pady=2)
-                        facepp_label = ttk.Label(right_frame, text="Face++ Analysis:", font=('Arial', 12, 'bold'), foreground="yellow")
-                        facepp_label.pack(padx=20, pady=5)
-                        if facepp_results:
-                            for key, value in facepp_results.items():
-                                ttk.Label(right_frame, text=f"{key}: {value}", font=('Arial', 12)).pack(padx=20, pady=2)
-                        else:
-                            ttk.Label(right_frame, text="No Face++ analysis available.", font=('Arial', 12)).pack(padx=20, pady=2)
+                        threading.Thread(target=run_osint_lookup, args=(frame.copy(), recognized[0][0], osint_results), daemon=True).start()
                     else:
                         ttk.Label(right_frame, text="No criminals recognized.", font=('Arial', 12)).pack(padx=20, pady=5)
                     old_recognized.clear()
                     old_recognized.extend(recog_names)
-            else:
-                message_queue.put("No faces detected in the current frame.")
-            showImage(frame, img_size)
+                    old_verdicts.clear()
+                    old_verdicts.update(is_live)
+                cv2.putText(frame, latency.summary(), (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+                showImage(frame, img_size)
         except Exception as e:
             message_queue.put(f"Error processing webcam frame: {str(e)}")
-        if webcam and webcam.isOpened() and root.winfo_exists():
-            root.after(33, update_frame)
-        else:
-            if webcam and webcam.isOpened():
-                webcam.release()
-            root.quit()
+        if pipeline.finished():
+            latency.stop()
+            if pipeline.error is not None:
+                message_queue.put(f"Error processing webcam frame: {str(pipeline.error)}")
+            else:
+                message_queue.put("Failed to capture video frame. Camera may be disconnected.")
+            return
+        root.after(15, update_frame)
     update_frame()
 
 def capture_image():
     global webcam, img_label, img_read
-    if webcam is None or not webcam.isOpened():
+    if webcam_pipeline is None or webcam_pipeline.finished():
         messagebox.showerror("Error", "Camera is not available.")
         return
-    ret, frame = webcam.read()
-    if ret and frame is not None and frame.size > 0:
-        cv2.imwrite("temp_capture.png", frame)
+    # The capture thread owns the camera, so take its most recent frame instead of reading another one
+    frame = webcam_frame.copy() if webcam_frame is not None else None
+    if frame is not None and frame.size > 0:
         img_read = frame
         img_size = (left_frame.winfo_width() - 40, left_frame.winfo_height() - 20)
         showImage(frame, img_size)
@@ -958,52 +1046,69 @@ def capture_image():
     else:
         messagebox.showerror("Error", "Failed to capture a valid image.")
 
-def videofile(path, model, names, img_size=(600,500)):
+def videofile(path, models, img_size=(600,500)):
+    # Decode, analysis and tracking run on pipeline threads; this side only polls for results on the Tk loop
     global thread_event
-    videofile = cv2.VideoCapture(path)
-    if not videofile.isOpened():
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
         message_queue.put("Failed to open video file")
         return
     old_recognized = []
     crims_found_labels = []
-    frame_count = 0
-    try:
-        while not thread_event.is_set():
-            ret, frame = videofile.read()
-            if not ret or frame is None or frame.size == 0:
-                message_queue.put("Failed to read valid frame from video file")
-                break
-            frame = cv2.flip(frame, 1, 0)
-            frame = cv2.resize(frame, img_size, interpolation=cv2.INTER_AREA)
-            face_coords, gray_frame, eye_coords = detect_faces(frame)
-            (frame, recognized) = recognize_face(model, frame, gray_frame, face_coords, names, eye_coords)
-            recog_names = [item[0] for item in recognized]
-            if recog_names != old_recognized:
-                for i, crim in enumerate(recognized):
-                    if i < len(crims_found_labels):
-                        crims_found_labels[i].configure(text=crim[0])
-                    else:
-                        label = ttk.Label(right_frame, text=crim[0], foreground="white", background="orange", font=('Arial', 15, 'bold'))
-                        label.pack(fill="x", padx=20, pady=10)
-                        if label.winfo_exists():
-                            label.bind("<Button-1>", lambda e, name=crim[0]: showCriminalProfile(name))
-                        crims_found_labels.append(label)
-                old_recognized = recog_names
-            frame_count += 1
-            if frame_count % 5 == 0:
+    tracker = FaceTracker()
+
+    def prepare(frame):
+        frame = cv2.flip(frame, 1, 0)
+        return cv2.resize(frame, img_size, interpolation=cv2.INTER_AREA)
+
+    def analyse(index, frame):
+        return analyse_frame(frame, tracker.detects_frame(index))
+
+    def combine(index, frame, analysis):
+        context, detections = analysis
+        tracker.update(detections)
+        snapshot = models.snapshot()
+        return recognize_tracks(snapshot.model, frame, context, tracker, snapshot.names, snapshot.version)
+
+    gate = MotionGate()
+    pipeline = VideoPipeline(capture, prepare, analyse, combine, gate=gate).start()
+
+    def poll():
+        nonlocal old_recognized
+        try:
+            if thread_event.is_set() or not left_frame.winfo_exists():
+                pipeline.stop()
+                return
+            result = pipeline.results.get_latest()
+            if result is not None:
+                (frame, recognized) = result
+                recog_names = [item[0] for item in recognized]
+                if recog_names != old_recognized:
+                    for i, crim in enumerate(recognized):
+                        if i < len(crims_found_labels):
+                            crims_found_labels[i].configure(text=crim[0])
+                        else:
+                            label = ttk.Label(right_frame, text=crim[0], foreground="white", background="orange", font=('Arial', 15, 'bold'))
+                            label.pack(fill="x", padx=20, pady=10)
+                            if label.winfo_exists():
+                                label.bind("<Button-1>", lambda e, name=crim[0]: showCriminalProfile(name))
+                            crims_found_labels.append(label)
+                    old_recognized = recog_names
                 if left_frame.winfo_width() > 0 and left_frame.winfo_height() > 0:
                     showImage(frame, img_size)
-            if cv2.waitKey(1) == 27:
-                break
-    except Exception as e:
-        message_queue.put(f"Video processing failed: {str(e)}")
-    finally:
-        videofile.release()
-        try:
+            if not pipeline.finished():
+                root.after(15, poll)
+                return
+            print(f"Motion gate for {os.path.basename(path)}: {gate.summary()}")
+            if pipeline.error is not None:
+                message_queue.put(f"Video processing failed: {str(pipeline.error)}")
+            else:
+                message_queue.put("Failed to read valid frame from video file")
             if left_frame.winfo_exists():
                 left_frame.destroy()
         except tk.TclError:
-            pass
+            pipeline.stop()
+    poll()
 
 def getPage3():
     global active_page, left_frame, right_frame, thread_event, heading
@@ -1033,10 +1138,9 @@ def getPage4(path):
     heading.configure(text="Video Surveillance")
     right_frame.configure(text="Detected Criminal")
     left_frame.configure()
-    (model, names) = train_model()
+    model_manager.ensure_loaded()
     thread_event = threading.Event()
-    thread = threading.Thread(target=videofile, args=(path, model, names))
-    thread.start()
+    videofile(path, model_manager)
 
 def getPage5():
     global active_page, left_frame, right_frame, heading, img_label, webcam, capture_button
@@ -1050,8 +1154,8 @@ def getPage5():
     heading.configure(text="Live Surveillance")
     right_frame.configure(text="Detected Criminals")
     left_frame.configure()
-    (model, names) = train_model()
-    run_webcam(model, names)
+    model_manager.ensure_loaded()
+    run_webcam(model_manager)
 
 def getPage6():
     global active_page, left_frame, right_frame, heading, img_label, progress_bar
@@ -1248,122 +1352,42 @@ def refresh_dashboard():
 
 # --- Vibrant and Professional Dashboard Layout with Real-Time Clock ---
 
-# Main dashboard
-dashboard_bg = "#1f2a38"  # deep navy
-highlight = "#00c2ff"    # vibrant cyan
-text_fg = "white"
-
-pages[0].configure(bg=dashboard_bg)
-
-# Function to update clock
-def update_clock():
-    now = time.strftime("%H:%M:%S | %d %b %Y")
-    clock_label.config(text=f"🕒 {now}")
-    clock_label.after(1000, update_clock)
-
-# Title section
-title_label = tk.Label(pages[0], text="Criminal Face Identification and OSINT Analysis System",
-                       font=('Arial', 35, 'bold'), fg=highlight, bg=dashboard_bg)
-title_label.pack(pady=(10, 0))
-
-logo = tk.PhotoImage(file="logo.png")
-tk.Label(pages[0], image=logo, bg=dashboard_bg).pack(pady=10)
-
-# Clock in header
-clock_label = tk.Label(pages[0], font=('Arial', 12, 'bold'), bg=dashboard_bg, fg=highlight)
-clock_label.pack()
-update_clock()
-
-# Dashboard card
-dashboard_frame = tk.LabelFrame(pages[0], text="Dashboard", labelanchor="n",
-                                 bg=dashboard_bg, fg=highlight, font=('Arial', 12, 'bold'), bd=2, relief="groove")
-dashboard_frame.pack(pady=20, padx=20, fill="x")
-refresh_dashboard()
-
-# Functional buttons section
-btn_frame = tk.Frame(pages[0], bg=dashboard_bg)
-btn_frame.pack()
-
-button_styles = [
-    ("📋 Register Criminal", getPage1),
-    ("🧠 Detect Criminal", getPage2),
-    ("🎥 Live Surveillance", getPage5),
-    ("📼 Video Surveillance", getPage3),
-    ("🖼️ Image Search", getPage6),
-    ("📁 View Database", view_db_results)
-]
-
-for text, command in button_styles:
-    btn = tk.Button(btn_frame, text=text, command=command, bg=highlight, fg="black",
-                    font=('Arial', 12, 'bold'), activebackground="#009ec9", activeforeground="white",
-                    width=20, height=2, bd=2, relief="ridge")
-    btn.bind("<Enter>", lambda e, b=btn: b.config(bg="#00e0ff"))
-    btn.bind("<Leave>", lambda e, b=btn: b.config(bg=highlight))
-    btn.pack(side="left", padx=15, pady=20)
-
-# Footer
-footer = tk.Label(pages[0], text="© 2025 Criminal Intelligence Lab | AI-Driven Surveillance & OSINT Toolkit",
-                   font=('Arial', 10), bg=dashboard_bg, fg="gray")
-footer.pack(side="bottom", pady=10)
-
-# Finalize view
-pages[0].lift()
-root.after(100, process_message_queue)
-root.protocol("WM_DELETE_WINDOW", lambda: [webcam.release() if webcam and webcam.isOpened() else None, root.quit()])
-root.mainloop()
-# --- Final Polished Home Page with Logo Animation and About Button ---
-
-# Add this at the end of your existing Page 0 (home/dashboard) setup:
-
-def setup_homepage():
-    pages[0].configure(bg="#1f2a38")
-
-    # Title frame with logo and animated zoom effect
-    title_frame = tk.Frame(pages[0], bg="#1f2a38")
-    title_frame.pack(pady=10)
-
-    logo_img = tk.PhotoImage(file="logo.png")
-    logo_lbl = tk.Label(title_frame, image=logo_img, bg="#1f2a38")
-    logo_lbl.image = logo_img
-    logo_lbl.pack(side="left", padx=10)
-
-    def on_enter_logo(e):
-        logo_lbl.config(cursor="hand2")
-        logo_lbl.after(0, lambda: logo_lbl.config(width=logo_img.width()+5))
-
-    def on_leave_logo(e):
-        logo_lbl.after(0, lambda: logo_lbl.config(width=logo_img.width()))
-
-    logo_lbl.bind("<Enter>", on_enter_logo)
-    logo_lbl.bind("<Leave>", on_leave_logo)
-
-    title_lbl = tk.Label(title_frame, text="Criminal Face Identification and OSINT Analysis System",
-                         font=('Arial', 35, 'bold'), fg="#00c2ff", bg="#1f2a38")
-    title_lbl.pack(side="left")
-
-    # Real-time clock
-    clock_label = tk.Label(pages[0], font=('Arial', 12, 'bold'), bg="#1f2a38", fg="#00c2ff")
-    clock_label.pack()
+if __name__ == "__main__":
+    # Main dashboard
+    dashboard_bg = "#1f2a38"  # deep navy
+    highlight = "#00c2ff"    # vibrant cyan
+    text_fg = "white"
 
+    pages[0].configure(bg=dashboard_bg)
+
+    # Function to update clock
     def update_clock():
         now = time.strftime("%H:%M:%S | %d %b %Y")
         clock_label.config(text=f"🕒 {now}")
         clock_label.after(1000, update_clock)
 
+    # Title section
+    title_label = tk.Label(pages[0], text="Criminal Face Identification and OSINT Analysis System",
+                           font=('Arial', 35, 'bold'), fg=highlight, bg=dashboard_bg)
+    title_label.pack(pady=(10, 0))
+
+    logo = tk.PhotoImage(file="logo.png")
+    tk.Label(pages[0], image=logo, bg=dashboard_bg).pack(pady=10)
+
+    # Clock in header
+    clock_label = tk.Label(pages[0], font=('Arial', 12, 'bold'), bg=dashboard_bg, fg=highlight)
+    clock_label.pack()
     update_clock()
 
-    # Dashboard section
+    # Dashboard card
     dashboard_frame = tk.LabelFrame(pages[0], text="Dashboard", labelanchor="n",
-                                     bg="#1f2a38", fg="#00c2ff", font=('Arial', 12, 'bold'), bd=2, relief="groove")
+                                     bg=dashboard_bg, fg=highlight, font=('Arial', 12, 'bold'), bd=2, relief="groove")
     dashboard_frame.pack(pady=20, padx=20, fill="x")
-
-    globals()['dashboard_frame'] = dashboard_frame
-    globals()['dashboard_labels'] = []
     refresh_dashboard()
 
-    # Navigation buttons
-    btn_frame = tk.Frame(pages[0], bg="#1f2a38")
-    btn_frame.pack(pady=20)
+    # Functional buttons section
+    btn_frame = tk.Frame(pages[0], bg=dashboard_bg)
+    btn_frame.pack()
 
     button_styles = [
         ("📋 Register Criminal", getPage1),
@@ -1375,30 +1399,111 @@ def setup_homepage():
     ]
 
     for text, command in button_styles:
-        btn = tk.Button(btn_frame, text=text, command=command, bg="#00c2ff", fg="black",
+        btn = tk.Button(btn_frame, text=text, command=command, bg=highlight, fg="black",
                         font=('Arial', 12, 'bold'), activebackground="#009ec9", activeforeground="white",
                         width=20, height=2, bd=2, relief="ridge")
-        btn.pack(side="left", padx=10, pady=10)
         btn.bind("<Enter>", lambda e, b=btn: b.config(bg="#00e0ff"))
-        btn.bind("<Leave>", lambda e, b=btn: b.config(bg="#00c2ff"))
-
-    # About button
-    def show_about():
-        messagebox.showinfo("About", "Developed by Pradeep Kumar\nCriminal Intelligence Lab 2025\nPowered by AI + OSINT Tools")
-
-    about_btn = tk.Button(pages[0], text="❓ About", command=show_about,
-                          font=('Arial', 10, 'bold'), bg="#273447", fg="white", width=12)
-    about_btn.pack(pady=5)
+        btn.bind("<Leave>", lambda e, b=btn: b.config(bg=highlight))
+        btn.pack(side="left", padx=15, pady=20)
 
     # Footer
     footer = tk.Label(pages[0], text="© 2025 Criminal Intelligence Lab | AI-Driven Surveillance & OSINT Toolkit",
-                      font=('Arial', 10), bg="#1f2a38", fg="gray")
+                       font=('Arial', 10), bg=dashboard_bg, fg="gray")
     footer.pack(side="bottom", pady=10)
 
+    # Finalize view
     pages[0].lift()
     root.after(100, process_message_queue)
-    root.protocol("WM_DELETE_WINDOW", lambda: [webcam.release() if webcam and webcam.isOpened() else None, root.quit()])
-
-# Call this once when launching
-setup_homepage()
+    root.protocol("WM_DELETE_WINDOW", close_app)
+    root.mainloop()
+    # --- Final Polished Home Page with Logo Animation and About Button ---
+
+    # Add this at the end of your existing Page 0 (home/dashboard) setup:
+
+    def setup_homepage():
+        pages[0].configure(bg="#1f2a38")
+
+        # Title frame with logo and animated zoom effect
+        title_frame = tk.Frame(pages[0], bg="#1f2a38")
+        title_frame.pack(pady=10)
+
+        logo_img = tk.PhotoImage(file="logo.png")
+        logo_lbl = tk.Label(title_frame, image=logo_img, bg="#1f2a38")
+        logo_lbl.image = logo_img
+        logo_lbl.pack(side="left", padx=10)
+
+        def on_enter_logo(e):
+            logo_lbl.config(cursor="hand2")
+            logo_lbl.after(0, lambda: logo_lbl.config(width=logo_img.width()+5))
+
+        def on_leave_logo(e):
+            logo_lbl.after(0, lambda: logo_lbl.config(width=logo_img.width()))
+
+        logo_lbl.bind("<Enter>", on_enter_logo)
+        logo_lbl.bind("<Leave>", on_leave_logo)
+
+        title_lbl = tk.Label(title_frame, text="Criminal Face Identification and OSINT Analysis System",
+                             font=('Arial', 35, 'bold'), fg="#00c2ff", bg="#1f2a38")
+        title_lbl.pack(side="left")
+
+        # Real-time clock
+        clock_label = tk.Label(pages[0], font=('Arial', 12, 'bold'), bg="#1f2a38", fg="#00c2ff")
+        clock_label.pack()
+
+        def update_clock():
+            now = time.strftime("%H:%M:%S | %d %b %Y")
+            clock_label.config(text=f"🕒 {now}")
+            clock_label.after(1000, update_clock)
+
+        update_clock()
+
+        # Dashboard section
+        dashboard_frame = tk.LabelFrame(pages[0], text="Dashboard", labelanchor="n",
+                                         bg="#1f2a38", fg="#00c2ff", font=('Arial', 12, 'bold'), bd=2, relief="groove")
+        dashboard_frame.pack(pady=20, padx=20, fill="x")
+
+        globals()['dashboard_frame'] = dashboard_frame
+        globals()['dashboard_labels'] = []
+        refresh_dashboard()
+
+        # Navigation buttons
+        btn_frame = tk.Frame(pages[0], bg="#1f2a38")
+        btn_frame.pack(pady=20)
+
+        button_styles = [
+            ("📋 Register Criminal", getPage1),
+            ("🧠 Detect Criminal", getPage2),
+            ("🎥 Live Surveillance", getPage5),
+            ("📼 Video Surveillance", getPage3),
+            ("🖼️ Image Search", getPage6),
+            ("📁 View Database", view_db_results)
+        ]
+
+        for text, command in button_styles:
+            btn = tk.Button(btn_frame, text=text, command=command, bg="#00c2ff", fg="black",
+                            font=('Arial', 12, 'bold'), activebackground="#009ec9", activeforeground="white",
+                            width=20, height=2, bd=2, relief="ridge")
+            btn.pack(side="left", padx=10, pady=10)
+            btn.bind("<Enter>", lambda e, b=btn: b.config(bg="#00e0ff"))
+            btn.bind("<Leave>", lambda e, b=btn: b.config(bg="#00c2ff"))
+
+        # About button
+        def show_about():
+            messagebox.showinfo("About", "Developed by Pradeep Kumar\nCriminal Intelligence Lab 2025\nPowered by AI + OSINT Tools")
+
+        about_btn = tk.Button(pages[0], text="❓ About", command=show_about,
+                              font=('Arial', 10, 'bold'), bg="#273447", fg="white", width=12)
+        about_btn.pack(pady=5)
+
+        # Footer
+        footer = tk.Label(pages[0], text="© 2025 Criminal Intelligence Lab | AI-Driven Surveillance & OSINT Toolkit",
+                          font=('Arial', 10), bg="#1f2a38", fg="gray")
+        footer.pack(side="bottom", pady=10)
+
+        pages[0].lift()
+        root.after(100, process_message_queue)
+        root.protocol("WM_DELETE_WINDOW", close_app)
+
+    # Call this once when launching
+    setup_homepage()
 
@@ -0,0 +1,67 @@
+import threading
+import time
+import cv2
+import numpy as np
+from frames import FrameContext
+
+# Motion-based liveness per face. Every face (keyed by track) keeps a ring buffer of its last LIVENESS_HISTORY
+# crops, resized to LIVENESS_ROI_SIZE and mean-normalized so lighting changes do not count as motion. A face
+# is live when it shows at least two eyes and its crop differs from its history by more than
+# LIVENESS_MOTION_THRESHOLD (mean absolute difference, 0-255 scale); a printed photo held still does not.
+# Until LIVENESS_MIN_HISTORY earlier crops are buffered the verdict is None (pending), never live.
+# All faces of a frame are scored in one vectorized pass, and the buffers are lock-protected, so one monitor
+# can be shared by the webcam and recognition threads.
+LIVENESS_ROI_SIZE = (32, 32)
+LIVENESS_HISTORY = 8
+LIVENESS_MOTION_THRESHOLD = 1.5
+LIVENESS_MIN_HISTORY = 3
+LIVENESS_MAX_IDLE = 10.0
+
+class LivenessMonitor:
+    def __init__(self, history=LIVENESS_HISTORY, size=LIVENESS_ROI_SIZE, threshold=LIVENESS_MOTION_THRESHOLD,
+                 max_idle=LIVENESS_MAX_IDLE, min_history=LIVENESS_MIN_HISTORY):
+        self.history = history
+        self.min_history = min(min_history, history)
+        self.size = size
+        self.threshold = threshold
+        self.max_idle = max_idle
+        self._faces = {}
+        self._lock = threading.Lock()
+
+    def check(self, frame, boxes, keys, eye_coords=None):
+        # frame may be a FrameContext, a BGR frame or a gray image; returns one verdict per box:
+        # True (live), False (spoof or fewer than two eyes) or None (pending, not enough history yet)
+        if len(boxes) == 0:
+            return []
+        crops = np.stack([cv2.resize(roi, self.size, interpolation=cv2.INTER_AREA)
+                          for roi in FrameContext.of(frame).rois(boxes)]).astype(np.float32)
+        crops -= crops.mean(axis=(1, 2), keepdims=True)
+        now = time.monotonic()
+        histories, counts = [], []
+        with self._lock:
+            for key, crop in zip(keys, crops):
+                entry = self._faces.get(key)
+                if entry is None:
+                    entry = self._faces[key] = [np.zeros((self.history,) + crop.shape, np.float32), 0, now]
+                ring, count, _ = entry
+                histories.append(ring.copy())
+                counts.append(min(count, self.history))
+                ring[count % self.history] = crop
+                entry[1] = count + 1
+                entry[2] = now
+            stale = [key for key, entry in self._faces.items() if now - entry[2] > self.max_idle]
+            for key in stale:
+                del self._faces[key]
+        counts = np.array(counts)
+        # (faces, history) mean absolute differences; slots not filled yet are masked out
+        diffs = np.abs(np.stack(histories) - crops[:, None]).mean(axis=(2, 3))
+        filled = np.arange(self.history)[None, :] < counts[:, None]
+        scores = np.where(filled, diffs, 0.0).sum(axis=1) / np.maximum(counts, 1)
+        moving = scores > self.threshold
+        eyes = np.array([len(e) >= 2 for e in eye_coords]) if eye_coords is not None else np.ones(len(boxes), bool)
+        judged = counts >= self.min_history
+        return [None if eye and not ready else bool(live) for live, eye, ready in zip(moving & eyes, eyes, judged)]
+
+    def forget(self, key):
+        with self._lock:
+            self._faces.pop(key, None)
@@ -0,0 +1,294 @@
+import collections
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+
+# Threaded video pipeline: decode -> analysis worker pool -> ordered combine stage -> latest result for the UI.
+# Stages are joined by bounded LatestQueues that drop the oldest frame instead of blocking, so a slow stage
+# costs frames rather than stalling the stages in front of it, and nothing here ever touches Tk.
+ANALYSIS_WORKERS = 2
+FRAME_QUEUE_SIZE = 2
+# Motion gate for recorded video: frames are compared as tiny grayscale thumbnails; a frame counts as moving
+# when more than MOTION_FRACTION of its pixels changed by more than MOTION_PIXEL_DELTA. While nothing moves
+# the gate doubles its stride up to MOTION_MAX_STRIDE and the frames in between are only grab()bed, not decoded.
+MOTION_SIZE = (64, 48)
+MOTION_PIXEL_DELTA = 25
+MOTION_FRACTION = 0.01
+MOTION_MAX_STRIDE = 8
+# Live quality control: QualityController keeps per-frame processing time within 1/TARGET_FPS by stepping
+# through QUALITY_LEVELS (detection scale, detect every N frames, re-identify uncertain tracks every N frames),
+# best first. It steps down when the smoothed frame time exceeds the budget and back up once it stays below
+# QUALITY_HEADROOM of the budget; QUALITY_PATIENCE frames must agree before either move.
+TARGET_FPS = 15
+QUALITY_LEVELS = [(1.0, 2, 10), (0.75, 3, 15), (0.5, 5, 30), (0.5, 8, 60), (0.33, 12, 90)]
+QUALITY_HEADROOM = 0.6
+QUALITY_PATIENCE = 10
+
+class LatestQueue:
+    def __init__(self, maxsize=1):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.closed = False
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        # Oldest queued item; None once the queue is closed and drained
+        with self._cond:
+            while not self._items and not self.closed:
+                if not self._cond.wait(timeout):
+                    raise queue.Empty
+            return self._items.popleft() if self._items else None
+
+    def get_latest(self):
+        # Non-blocking: newest item, discarding anything older; None if nothing is waiting
+        with self._cond:
+            if not self._items:
+                return None
+            item = self._items.pop()
+            self.dropped += len(self._items)
+            self._items.clear()
+            return item
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def drained(self):
+        with self._cond:
+            return self.closed and not self._items
+
+class MotionGate:
+    def __init__(self, pixel_delta=MOTION_PIXEL_DELTA, fraction=MOTION_FRACTION, max_stride=MOTION_MAX_STRIDE, size=MOTION_SIZE):
+        self.pixel_delta = pixel_delta
+        self.fraction = fraction
+        self.max_stride = max(1, max_stride)
+        self.size = size
+        self.stride = 1
+        self.stats = {"frames": 0, "decoded": 0, "forwarded": 0}
+        self._previous = None
+
+    def check(self, frame):
+        # True if the frame changed enough to be analysed; adjusts the stride for the frames that follow.
+        # Counts the frame itself; frames the caller grab()s past instead of decoding go through skipped().
+        self.stats["frames"] += 1
+        self.stats["decoded"] += 1
+        thumb = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if thumb.ndim == 3:
+            thumb = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+        # Compared against the last forwarded frame, so slow motion accumulates until it crosses the threshold
+        moving = self._previous is None or np.count_nonzero(cv2.absdiff(thumb, self._previous) > self.pixel_delta) > self.fraction * thumb.size
+        self.stride = 1 if moving else min(self.stride * 2, self.max_stride)
+        if moving:
+            self._previous = thumb
+            self.stats["forwarded"] += 1
+        return moving
+
+    def skipped(self, count=1):
+        self.stats["frames"] += count
+
+    def skip_ratio(self):
+        return 1.0 - self.stats["forwarded"] / max(self.stats["frames"], 1)
+
+    def summary(self):
+        frames, forwarded = self.stats["frames"], self.stats["forwarded"]
+        return (f"{frames} frames, {frames - forwarded} skipped ({self.skip_ratio():.0%}), "
+                f"{frames - self.stats['decoded']} not decoded, ~{frames / max(forwarded, 1):.1f}x fewer analysed")
+
+class QualityController:
+    def __init__(self, target_fps=TARGET_FPS, levels=QUALITY_LEVELS, headroom=QUALITY_HEADROOM, patience=QUALITY_PATIENCE):
+        self.budget = 1.0 / target_fps
+        self.levels = levels
+        self.headroom = headroom
+        self.patience = patience
+        self.level = 0
+        self.frame_time = 0.0
+        self._streak = 0
+
+    @property
+    def scale(self):
+        return self.levels[self.level][0]
+
+    def apply(self, tracker):
+        _, tracker.detect_every, tracker.reidentify_every = self.levels[self.level]
+
+    def record(self, seconds):
+        # Feeds one frame's processing time; returns True when the quality level changed
+        self.frame_time = seconds if not self.frame_time else 0.8 * self.frame_time + 0.2 * seconds
+        if self.frame_time > self.budget and self.level < len(self.levels) - 1:
+            self._streak = max(self._streak, 0) + 1
+        elif self.frame_time < self.headroom * self.budget and self.level > 0:
+            self._streak = min(self._streak, 0) - 1
+        else:
+            self._streak = 0
+        if abs(self._streak) < self.patience:
+            return False
+        self.level += 1 if self._streak > 0 else -1
+        self._streak = 0
+        return True
+
+    def summary(self):
+        scale, detect_every, reidentify_every = self.levels[self.level]
+        fps = 1.0 / max(self.frame_time, self.budget)
+        return (f"{fps:.1f} fps ({self.frame_time * 1000:.0f} ms/frame) | level {self.level} | scale {scale} | "
+                f"detect 1/{detect_every} | re-id 1/{reidentify_every}")
+
+class EventLatencyProbe:
+    # Measures UI responsiveness as the lateness of a periodic timer callback: anything blocking the event loop
+    # (Tk's root.after here) delays the tick by exactly that long
+    def __init__(self, schedule, interval_ms=50):
+        self.schedule = schedule
+        self.interval_ms = interval_ms
+        self.average = 0.0
+        self.worst = 0.0
+        self.ticks = 0
+        self._running = False
+        self._due = 0.0
+
+    def start(self):
+        self._running = True
+        self._arm()
+
+    def stop(self):
+        self._running = False
+
+    def _arm(self):
+        self._due = time.perf_counter() + self.interval_ms / 1000.0
+        self.schedule(self.interval_ms, self._tick)
+
+    def _tick(self):
+        if not self._running:
+            return
+        late = max(0.0, time.perf_counter() - self._due)
+        self.ticks += 1
+        self.average = late if self.ticks == 1 else 0.9 * self.average + 0.1 * late
+        self.worst = max(self.worst, late)
+        self._arm()
+
+    def summary(self):
+        return f"UI latency {self.average * 1000:.0f} ms avg, {self.worst * 1000:.0f} ms max"
+
+class VideoPipeline:
+    # prepare(frame) runs on the decode thread, analyse(index, frame) on the worker pool (must be thread-safe),
+    # combine(index, frame, analysis) on a single thread in frame order; its return value is published to results.
+    # Frames that finish analysis after a newer frame has been combined are dropped. With a MotionGate, static
+    # frames never reach the workers; indices are always source frame numbers.
+    def __init__(self, capture, prepare, analyse, combine, workers=ANALYSIS_WORKERS, queue_size=FRAME_QUEUE_SIZE, realtime=True, gate=None):
+        self.capture = capture
+        self.prepare = prepare
+        self.analyse = analyse
+        self.combine = combine
+        self.workers = max(1, workers)
+        self.realtime = realtime
+        self.gate = gate
+        self.frames = LatestQueue(queue_size)
+        self.analysed = LatestQueue(queue_size + self.workers)
+        self.results = LatestQueue(1)
+        self.error = None
+        self.stats = {"decoded": 0, "combined": 0, "late": 0}
+        self._stop = threading.Event()
+        self._threads = []
+        self._running_analysers = self.workers
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._decode, daemon=True), threading.Thread(target=self._combine_loop, daemon=True)]
+        self._threads.extend(threading.Thread(target=self._analyse_loop, daemon=True) for _ in range(self.workers))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.frames.close()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def finished(self):
+        return self.results.drained()
+
+    def _fail(self, e):
+        if self.error is None:
+            self.error = e
+        self.stop()
+
+    def _decode(self):
+        try:
+            # Recorded files are paced to their own frame rate, so dropping keeps playback in real time
+            fps = self.capture.get(cv2.CAP_PROP_FPS) if self.realtime else 0
+            interval = 1.0 / fps if fps and fps > 0 else 0
+            index = 0
+            started = time.perf_counter()
+            while not self._stop.is_set():
+                ret, frame = self.capture.read()
+                if not ret or frame is None or frame.size == 0:
+                    break
+                self.stats["decoded"] += 1
+                index += 1
+                if self.gate is None:
+                    self.frames.put((index - 1, self.prepare(frame)))
+                else:
+                    if self.gate.check(frame):
+                        self.frames.put((index - 1, self.prepare(frame)))
+                    for _ in range(self.gate.stride - 1):
+                        if not self.capture.grab():
+                            break
+                        self.gate.skipped()
+                        index += 1
+                if interval:
+                    delay = started + index * interval - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self.capture.release()
+            self.frames.close()
+
+    def _analyse_loop(self):
+        try:
+            while True:
+                item = self.frames.get()
+                if item is None:
+                    break
+                index, frame = item
+                self.analysed.put((index, frame, self.analyse(index, frame)))
+        except Exception as e:
+            self._fail(e)
+        finally:
+            with self._lock:
+                self._running_analysers -= 1
+                if self._running_analysers == 0:
+                    self.analysed.close()
+
+    def _combine_loop(self):
+        last = -1
+        try:
+            while True:
+                item = self.analysed.get()
+                if item is None:
+                    break
+                index, frame, analysis = item
+                if index < last:
+                    self.stats["late"] += 1
+                    continue
+                last = index
+                self.results.put(self.combine(index, frame, analysis))
+                self.stats["combined"] += 1
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self.results.close()
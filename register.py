@@ -6,11 +6,14 @@ from PIL import Image, ImageTk
 from datetime import datetime
 import json
 import traceback
+from facerec import record_normalized_crops
+from detectors import get_cascade, FRONTAL_FACE_CASCADE
 
 # === FACE DETECTION ===
 def detect_faces(gray_img):
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    if face_cascade.empty():
+    try:
+        face_cascade = get_cascade(FRONTAL_FACE_CASCADE)
+    except FileNotFoundError:
         print("Error: Could not load Haar cascade file.")
         return []
     # Adjusted parameters to improve detection
@@ -39,6 +42,8 @@ def registerCriminal(img, path, img_num):
             file_num += 1
             face = cv2.flip(face, 1)
             cv2.imwrite(f'{path}/{file_num}.png', face)
+            # Mark both crops as normalized so training can use them without re-detecting the face
+            record_normalized_crops(path, [f'{file_num - 1}.png', f'{file_num}.png'], (im_width, im_height))
             print(f"Image {img_num}: Face detected and saved successfully at {path}/{file_num}.png")
         except Exception as e:
             print(f"Image {img_num}: Failed to save face image: {str(e)}")
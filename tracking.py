@@ -0,0 +1,121 @@
+import itertools
+from detectors import box_iou
+
+# Track-by-detection for video streams. Full face detection only runs every DETECT_EVERY frames; in between,
+# tracks keep their last box. Identities are carried per track and only looked up again when a track is new,
+# uncertain (its last match was close to the recognition threshold) or older than REIDENTIFY_MAX_AGE frames.
+DETECT_EVERY = 5
+REIDENTIFY_EVERY = 15
+REIDENTIFY_MAX_AGE = 150
+MIN_IOU = 0.3
+MAX_MISSES = 2
+
+class Track:
+    def __init__(self, track_id, box, frame_index):
+        self.track_id = track_id
+        self.box = tuple(int(v) for v in box)
+        self.first_frame = frame_index
+        self.last_seen = frame_index
+        self.misses = 0
+        self.label = None
+        self.name = None
+        self.confidence = float("inf")
+        self.uncertain = True
+        self.identified_at = None
+
+    def __repr__(self):
+        return f"Track({self.track_id}, {self.box}, {self.name!r}, {self.confidence:.2f})"
+
+class FaceTracker:
+    def __init__(self, detect_every=DETECT_EVERY, reidentify_every=REIDENTIFY_EVERY,
+                 reidentify_max_age=REIDENTIFY_MAX_AGE, min_iou=MIN_IOU, max_misses=MAX_MISSES):
+        self.detect_every = max(1, detect_every)
+        self.reidentify_every = reidentify_every
+        self.reidentify_max_age = reidentify_max_age
+        self.min_iou = min_iou
+        self.max_misses = max_misses
+        self.tracks = []
+        self.frame_index = -1
+        self._last_detection = -self.detect_every
+        self.model_version = None
+        self._ids = itertools.count(1)
+        self.stats = {"frames": 0, "detections": 0, "identifications": 0, "tracks_created": 0}
+
+    def needs_detection(self):
+        # Asked before update() for the upcoming frame
+        return (self.frame_index + 1) % self.detect_every == 0
+
+    def detects_frame(self, frame_number):
+        # For pipelines that pick detection frames by source frame number, ahead of update(). Frame numbers can
+        # jump (dropped or motion-gated frames), so the stride counts from the last frame picked for detection.
+        if frame_number < self._last_detection or frame_number - self._last_detection >= self.detect_every:
+            self._last_detection = frame_number
+            return True
+        return False
+
+    def update(self, detections=None):
+        # detections=None means this frame was not run through the detector, so tracks keep their boxes
+        self.frame_index += 1
+        self.stats["frames"] += 1
+        if detections is None:
+            return self.active()
+        self.stats["detections"] += 1
+        detections = [tuple(int(v) for v in box) for box in detections]
+        pairs = sorted(((box_iou(track.box, box), t, d) for t, track in enumerate(self.tracks)
+                        for d, box in enumerate(detections)), reverse=True)
+        matched_tracks, matched_detections = set(), set()
+        for iou, t, d in pairs:
+            if iou < self.min_iou:
+                break
+            if t in matched_tracks or d in matched_detections:
+                continue
+            track = self.tracks[t]
+            track.box = detections[d]
+            track.last_seen = self.frame_index
+            track.misses = 0
+            matched_tracks.add(t)
+            matched_detections.add(d)
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        for d, box in enumerate(detections):
+            if d not in matched_detections:
+                self.tracks.append(Track(next(self._ids), box, self.frame_index))
+                self.stats["tracks_created"] += 1
+        return self.active()
+
+    def active(self):
+        # Tracks confirmed by the most recent detection pass
+        return [track for track in self.tracks if track.misses == 0]
+
+    def to_identify(self):
+        pending = []
+        for track in self.active():
+            if track.identified_at is None:
+                pending.append(track)
+                continue
+            age = self.frame_index - track.identified_at
+            if age >= self.reidentify_max_age or (track.uncertain and age >= self.reidentify_every):
+                pending.append(track)
+        return pending
+
+    def assign(self, track, label, name, confidence, uncertain):
+        track.label = label
+        track.name = name
+        track.confidence = confidence
+        track.uncertain = uncertain
+        track.identified_at = self.frame_index
+        self.stats["identifications"] += 1
+
+    def set_model_version(self, version):
+        # A retrained model may label people differently, so every track is identified again
+        if version != self.model_version:
+            self.model_version = version
+            for track in self.tracks:
+                track.identified_at = None
+
+    def reset(self):
+        self.tracks = []
+        self.frame_index = -1
+        self._last_detection = -self.detect_every